@@ -19,13 +19,121 @@ Oppure:
 import math
 import numpy as np
 import matplotlib.pyplot as plt
-import matplotlib.patches as patches
+from matplotlib.collections import PolyCollection
 from matplotlib.lines import Line2D
 from matplotlib.colors import Normalize
 from matplotlib.cm import ScalarMappable
 import geopandas as gpd
+import shapely
 from shapely.geometry import Polygon, LineString, Point
 
+# Numba opzionale: accelera create_panel_rectangles per N molto grandi
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# Sotto questa soglia la versione NumPy è già sufficiente (e non paga la compilazione JIT)
+NUMBA_MIN_BUILDINGS = 10000
+
+
+def create_panel_rectangles(centroids_xy, p1_xy, p2_xy):
+    """
+    Versione vettoriale: crea i rettangoli pannelli di N edifici in un colpo solo.
+    Stessi 3 step di create_panel_rectangle, applicati a interi array (N,2).
+    Con numba installato e N >= NUMBA_MIN_BUILDINGS usa il kernel JIT (nogil).
+    
+    Args:
+        centroids_xy: array (N, 2) - centroidi degli edifici
+        p1_xy, p2_xy: array (N, 2) - endpoints del lato lungo
+    
+    Returns:
+        array (N, 4, 2) con i vertici [p1, p2, p3, p4] di ogni rettangolo;
+        le righe con lato lungo degenere (< 1e-6) sono NaN
+    """
+    c = np.asarray(centroids_xy, dtype=float).reshape(-1, 2)
+    p1 = np.asarray(p1_xy, dtype=float).reshape(-1, 2)
+    p2 = np.asarray(p2_xy, dtype=float).reshape(-1, 2)
+    
+    if njit is not None and len(c) >= NUMBA_MIN_BUILDINGS:
+        out = np.empty((len(c), 4, 2))
+        _create_panel_rectangles_nb(
+            np.ascontiguousarray(c), np.ascontiguousarray(p1), np.ascontiguousarray(p2), out
+        )
+        return out
+    return _create_panel_rectangles_np(c, p1, p2)
+
+
+def _create_panel_rectangles_np(c, p1, p2):
+    """Implementazione NumPy di create_panel_rectangles (array (N,2) float)."""
+    # Step 1: Vettore lato lungo
+    lato = p2 - p1
+    lato_len = np.linalg.norm(lato, axis=1, keepdims=True)
+    degenerate = lato_len[:, 0] < 1e-6
+    safe_len = np.where(degenerate[:, None], 1.0, lato_len)
+    
+    # Step 2: Perpendicolare unitaria, orientata verso il centroide
+    perp = np.stack([-lato[:, 1], lato[:, 0]], axis=1) / safe_len
+    to_centroid = c - 0.5 * (p1 + p2)
+    sign = np.where(np.einsum('ij,ij->i', perp, to_centroid) < 0, -1.0, 1.0)
+    perp *= sign[:, None]
+    
+    # Step 3: Proiezione del centroide sul lato e distanza perpendicolare
+    t = np.clip(np.einsum('ij,ij->i', c - p1, lato) / safe_len[:, 0] ** 2, 0, 1)
+    proj = p1 + t[:, None] * lato
+    h = np.linalg.norm(c - proj, axis=1, keepdims=True)
+    # Centroide già sul lato, usa piccola altezza
+    h = np.where(h < 1e-6, 0.1 * lato_len, h)
+    
+    p3 = p2 + h * perp
+    p4 = p1 + h * perp
+    
+    verts = np.stack([p1, p2, p3, p4], axis=1)
+    verts[degenerate] = np.nan
+    return verts
+
+
+if njit is not None:
+    # nogil e non parallel, come _ray_hit_kernel: viene chiamato anche dai thread
+    # dell'app (pv_overlay) e il layer workqueue di Numba non regge lanci paralleli concorrenti
+    @njit(nogil=True, cache=True)
+    def _create_panel_rectangles_nb(c, p1, p2, out):
+        """Kernel numba di create_panel_rectangles: un solo loop, niente temporanei."""
+        for i in range(c.shape[0]):
+            lx = p2[i, 0] - p1[i, 0]
+            ly = p2[i, 1] - p1[i, 1]
+            lato_len = np.sqrt(lx * lx + ly * ly)
+            if lato_len < 1e-6:
+                out[i, :, :] = np.nan
+                continue
+            
+            # Perpendicolare unitaria, orientata verso il centroide
+            px = -ly / lato_len
+            py = lx / lato_len
+            mx = 0.5 * (p1[i, 0] + p2[i, 0])
+            my = 0.5 * (p1[i, 1] + p2[i, 1])
+            if px * (c[i, 0] - mx) + py * (c[i, 1] - my) < 0:
+                px = -px
+                py = -py
+            
+            # Proiezione del centroide sul lato e distanza perpendicolare
+            t = ((c[i, 0] - p1[i, 0]) * lx + (c[i, 1] - p1[i, 1]) * ly) / (lato_len * lato_len)
+            t = min(max(t, 0.0), 1.0)
+            dx = c[i, 0] - (p1[i, 0] + t * lx)
+            dy = c[i, 1] - (p1[i, 1] + t * ly)
+            h = np.sqrt(dx * dx + dy * dy)
+            if h < 1e-6:
+                h = 0.1 * lato_len
+            
+            out[i, 0, 0] = p1[i, 0]
+            out[i, 0, 1] = p1[i, 1]
+            out[i, 1, 0] = p2[i, 0]
+            out[i, 1, 1] = p2[i, 1]
+            out[i, 2, 0] = p2[i, 0] + h * px
+            out[i, 2, 1] = p2[i, 1] + h * py
+            out[i, 3, 0] = p1[i, 0] + h * px
+            out[i, 3, 1] = p1[i, 1] + h * py
+
 
 def create_panel_rectangle(centroid, long_side_p1, long_side_p2):
     """
@@ -39,54 +147,12 @@ def create_panel_rectangle(centroid, long_side_p1, long_side_p2):
         long_side_p1, long_side_p2: tuple (x, y) - endpoints del lato lungo
     
     Returns:
-        Polygon rettangolo pannelli
+        Polygon rettangolo pannelli (None se il lato lungo è degenere)
     """
-    
-    p1 = np.array(long_side_p1)
-    p2 = np.array(long_side_p2)
-    c = np.array([centroid.x, centroid.y])
-    
-    # Step 1: Vettore lato lungo
-    lato_vec = p2 - p1
-    lato_len = np.linalg.norm(lato_vec)
-    
-    if lato_len < 1e-6:
+    verts = create_panel_rectangles([[centroid.x, centroid.y]], [long_side_p1], [long_side_p2])[0]
+    if np.isnan(verts).any():
         return None
-    
-    # Step 2: Vettore perpendicolare al lato (ruota 90° verso il centroide)
-    # Perpendicolare: (-y, x) oppure (y, -x)
-    perp_vec = np.array([-lato_vec[1], lato_vec[0]])
-    perp_vec = perp_vec / np.linalg.norm(perp_vec)
-    
-    # Determina direzione perpendicolare verso centroide
-    to_centroid = c - (p1 + p2) / 2  # vettore dal midpoint verso centroide
-    if np.dot(perp_vec, to_centroid) < 0:
-        perp_vec = -perp_vec
-    
-    # Step 3: Calcola proiezione perpendiculare del centroide sul lato
-    # Proiezione: t = (c - p1) · (p2 - p1) / |p2 - p1|²
-    t = np.dot(c - p1, lato_vec) / (lato_len ** 2)
-    t = np.clip(t, 0, 1)  # Limita tra p1 e p2
-    
-    proj_point = p1 + t * lato_vec
-    
-    # Distanza perpendicolare
-    perp_dist = np.linalg.norm(c - proj_point)
-    
-    if perp_dist < 1e-6:
-        # Centroide già sul lato, usa piccola altezza
-        perp_dist = lato_len * 0.1
-    
-    # Costruisci rettangolo: 4 vertici
-    # Base = lato lungo (p1, p2)
-    # Altezza = distanza perpendicolare (dal lato verso centroide)
-    
-    p3 = p2 + perp_dist * perp_vec
-    p4 = p1 + perp_dist * perp_vec
-    
-    rect_polygon = Polygon([p1, p2, p3, p4])
-    
-    return rect_polygon
+    return Polygon(verts)
 
 
 def compute_quintiles(values):
@@ -99,32 +165,39 @@ def compute_quintiles(values):
     Returns:
         (quintile_boundaries, quintile_labels)
     """
-    values_sorted = sorted([v for v in values if v is not None and v > 0])
+    arr = np.asarray(values, dtype=float)  # None → NaN
+    arr = arr[np.isfinite(arr) & (arr > 0)]
     
-    if len(values_sorted) == 0:
+    if arr.size == 0:
         return [0, 1], ["0-1"]
     
-    # Calcola quintili
-    q0 = min(values_sorted)
-    q20 = np.percentile(values_sorted, 20)
-    q40 = np.percentile(values_sorted, 40)
-    q60 = np.percentile(values_sorted, 60)
-    q80 = np.percentile(values_sorted, 80)
-    q100 = max(values_sorted)
-    
-    boundaries = [q0, q20, q40, q60, q80, q100]
-    
-    labels = [
-        f"{q0:.0f}-{q20:.0f}",
-        f"{q20:.0f}-{q40:.0f}",
-        f"{q40:.0f}-{q60:.0f}",
-        f"{q60:.0f}-{q80:.0f}",
-        f"{q80:.0f}-{q100:.0f}"
-    ]
+    # Calcola quintili con una sola chiamata (0% e 100% = min e max)
+    boundaries = np.percentile(arr, [0, 20, 40, 60, 80, 100]).tolist()
+    
+    labels = [f"{lo:.0f}-{hi:.0f}" for lo, hi in zip(boundaries[:-1], boundaries[1:])]
     
     return boundaries, labels
 
 
+def values_to_quintiles(values, boundaries):
+    """
+    Versione vettoriale di value_to_quintile: una sola ricerca binaria in C.
+    
+    Args:
+        values: array-like di valori numerici (None/<=0 → quintile 0)
+        boundaries: lista 6 elementi da compute_quintiles
+    
+    Returns:
+        np.ndarray di int (0-4) - indice quintile per ogni valore
+    """
+    values = np.asarray(values, dtype=float)
+    bounds = np.asarray(boundaries, dtype=float)
+    q_idx = np.searchsorted(bounds[1:-1], values, side='right')
+    q_idx = np.clip(q_idx, 0, len(bounds) - 2)
+    q_idx[~(values > 0)] = 0
+    return q_idx
+
+
 def value_to_quintile(value, boundaries):
     """
     Assegna un valore al suo quintile (0-4).
@@ -138,12 +211,7 @@ def value_to_quintile(value, boundaries):
     """
     if value is None or value <= 0:
         return 0
-    
-    for i in range(len(boundaries) - 1):
-        if boundaries[i] <= value < boundaries[i + 1]:
-            return i
-    
-    return len(boundaries) - 2
+    return int(values_to_quintiles([value], boundaries)[0])
 
 
 def get_quintile_colors():
@@ -189,18 +257,38 @@ def plot_pv_potential(gdf, results, output_path='pv_potential_map.png', figsize=
     boundaries, q_labels = compute_quintiles(energy_values)
     colors = get_quintile_colors()
     
-    # Plot background: tutti gli edifici in grigio
-    gdf.plot(ax=ax, color='lightgrey', edgecolor='darkgrey', alpha=0.6, linewidth=0.5)
-    
-    # Plot pannelli colorati per quintile
-    for idx, row in gdf.iterrows():
-        if idx not in results or results[idx] is None:
+    # Plot background: tutti gli edifici in grigio (una sola collection).
+    # Anelli esterni estratti in blocco con shapely 2 e divisi per poligono.
+    parts = gdf.geometry.explode(index_parts=False)
+    parts = parts[parts.geom_type == 'Polygon'].to_numpy()
+    bg_coords, ring_idx = shapely.get_coordinates(shapely.get_exterior_ring(parts), return_index=True)
+    bg_verts = np.split(bg_coords, np.flatnonzero(np.diff(ring_idx)) + 1) if len(bg_coords) else []
+    ax.add_collection(PolyCollection(
+        bg_verts,
+        facecolors='lightgrey',
+        edgecolors='darkgrey',
+        linewidths=0.5,
+        alpha=0.6,
+        zorder=1
+    ))
+    
+    # Plot pannelli colorati per quintile: raccogli centroidi/endpoints,
+    # calcola tutti i rettangoli in un colpo e disegna un'unica PolyCollection
+    panel_centroids = []
+    panel_p1 = []
+    panel_p2 = []
+    panel_energies = []
+    # Accesso diretto agli array (niente Series per riga come con iterrows).
+    # Il centroide è già in results (location.centroid_xy, calcolato dall'analisi):
+    # lo si ricalcola dalla geometria solo per risultati che non lo contengono.
+    indices = gdf.index.to_numpy()
+    geom_centroids_xy = None
+    for i in range(len(gdf)):
+        idx = indices[i]
+        building_data = results.get(idx)
+        if building_data is None:
             continue
         
-        result = results[idx]
-        building_data = result
-        
-        # Estrai geometria pannelli
         try:
             # Estrai endpoints del lato lungo sud da building_props (salvati in pvgis_analyzer)
             building_props = building_data.get('building_props', {})
@@ -210,36 +298,54 @@ def plot_pv_potential(gdf, results, output_path='pv_potential_map.png', figsize=
                 continue
             
             p1, p2 = long_side_endpoints
-            geom = row.geometry
-            centroid = geom.centroid
-            
-            # Crea rettangolo pannelli usando i 3 step
-            panel_rect = create_panel_rectangle(centroid, p1, p2)
-            
-            if panel_rect is None or panel_rect.is_empty:
-                continue
-            
-            # Determina colore per quintile
             energy = building_data['annual_metrics']['energy_kwh']
-            quintile_idx = value_to_quintile(energy, boundaries)
-            color = colors[quintile_idx]
             
-            # Plot rettangolo
-            patch = patches.Polygon(
-                list(panel_rect.exterior.coords[:-1]),
-                facecolor=color,
-                edgecolor='black',
-                linewidth=0.3,
-                alpha=0.8,
-                zorder=5
-            )
-            ax.add_patch(patch)
+            centroid_xy = (building_data.get('location') or {}).get('centroid_xy')
+            if centroid_xy is None:
+                if geom_centroids_xy is None:
+                    centroids = gdf.geometry.centroid
+                    geom_centroids_xy = np.column_stack([centroids.x.to_numpy(), centroids.y.to_numpy()])
+                centroid_xy = geom_centroids_xy[i]
+            
+            panel_centroids.append(tuple(centroid_xy))
+            panel_p1.append(p1)
+            panel_p2.append(p2)
+            panel_energies.append(energy)
             
         except Exception as e:
             # Se fallisce per un edificio, continua con gli altri
             print(f"  Warning: Could not plot panels for building {idx}: {e}")
             continue
     
+    panel_verts = []
+    panel_colors = []
+    if panel_centroids:
+        # Crea rettangoli pannelli usando i 3 step (vettoriale)
+        verts = create_panel_rectangles(panel_centroids, panel_p1, panel_p2)
+        valid = ~np.isnan(verts).any(axis=(1, 2))
+        panel_verts = verts[valid]
+        # Determina colore per quintile (vettoriale)
+        q_idx = values_to_quintiles(panel_energies, boundaries)
+        panel_colors = np.array(colors)[q_idx[valid]]
+    
+    if len(panel_verts):
+        ax.add_collection(PolyCollection(
+            panel_verts,
+            facecolors=panel_colors,
+            edgecolors='black',
+            linewidths=0.3,
+            alpha=0.8,
+            zorder=5
+        ))
+    
+    # Le collection non aggiornano la vista da sole (gdf.plot lo faceva): usa i bounds
+    minx, miny, maxx, maxy = gdf.total_bounds
+    if np.all(np.isfinite([minx, miny, maxx, maxy])):
+        pad_x = (maxx - minx) * 0.02 or 1.0
+        pad_y = (maxy - miny) * 0.02 or 1.0
+        ax.set_xlim(minx - pad_x, maxx + pad_x)
+        ax.set_ylim(miny - pad_y, maxy + pad_y)
+    
     # Configura assi
     ax.set_aspect('equal')
     ax.set_xlabel('X (m)', fontsize=12)
@@ -272,9 +378,9 @@ if __name__ == '__main__':
     import json
     from pathlib import Path
     
-    # Uso standalone: python plot_viewer.py results_dict.json gdf.pkl output.png
+    # Uso standalone: python plot_viewer.py results.parquet gdf.geojson output.png
     if len(sys.argv) < 3:
-        print('Usage: python plot_viewer.py <results_json> <gdf_geojson> <output_png>')
+        print('Usage: python plot_viewer.py <results_parquet> <gdf_geojson> <output_png>')
         print('  or import and use: plot_pv_potential(gdf, results, output_path)')
         sys.exit(1)
     
@@ -282,12 +388,16 @@ if __name__ == '__main__':
     gdf_path = sys.argv[2]
     output_path = sys.argv[3] if len(sys.argv) > 3 else 'pv_potential_map.png'
     
-    # Carica results da JSON
-    with open(results_path, 'r') as f:
-        results = json.load(f)
+    # Carica results: parquet (da pvgis_analyzer.save_results_parquet) o JSON legacy
+    if Path(results_path).suffix.lower() == '.json':
+        with open(results_path, 'r') as f:
+            results = {int(k): v for k, v in json.load(f).items()}
+    else:
+        from pvgis_analyzer import load_results_parquet
+        results = load_results_parquet(results_path)
     
     # Carica GeoDataFrame da GeoJSON
     gdf = gpd.read_file(gdf_path)
     
     # Plot
-    plot_pv_potential(gdf, results, output_path)
\ No newline at end of file
+    plot_pv_potential(gdf, results, output_path)
@@ -1,96 +1,101 @@
 import folium
+import numpy as np
 import geopandas as gpd
 from branca.colormap import linear
 from pathlib import Path
 
-def plot_pv_potential_folium_html(gdf, results):
+# Tolleranza di semplificazione (metri) delle geometrie prima della serializzazione
+SIMPLIFY_TOLERANCE_M = 0.5
+
+def _energy_column(gdf, results):
+    """Energia annua (kWh) per ogni edificio del gdf, 0 se assente, come array numpy."""
+    return np.fromiter(
+        ((results.get(idx) or {}).get('annual_metrics', {}).get('energy_kwh', 0) for idx in gdf.index),
+        dtype=np.float64,
+        count=len(gdf)
+    )
+
+def _build_folium_map(gdf, results, simplify_tolerance=SIMPLIFY_TOLERANCE_M):
     """
-    Crea una mappa Folium con due layer e restituisce l'HTML come stringa.
-    - Layer base: edifici originali (grigio, trasparente)
-    - Layer FV: edifici colorati per potenziale FV
+    Costruisce la mappa Folium con un layer edifici (logica comune a html/file).
+    - Senza risultati: layer base (grigio, trasparente)
+    - Con risultati: layer FV, edifici colorati per potenziale FV
+    Le geometrie vengono semplificate nel CRS metrico e riproiettate in EPSG:4326
+    una sola volta, così l'HTML contiene meno vertici.
     Args:
         gdf: GeoDataFrame degli edifici
         results: dict di risultati da process_all_buildings()
+        simplify_tolerance: Tolleranza in metri (0/None per disattivare)
     Returns:
-        html: stringa HTML della mappa
+        (m, min_e, max_e): mappa Folium e range di energia usato dalla colormap
     """
-    gdf = gdf.copy()
-    gdf['energy_kwh'] = gdf.index.map(lambda idx: results.get(idx, {}).get('annual_metrics', {}).get('energy_kwh', 0))
+    # Solo le colonne che servono: il GeoJSON serializzato resta minimo
+    energy = _energy_column(gdf, results)
+    gdf = gpd.GeoDataFrame({'energy_kwh': energy}, geometry=gdf.geometry.values, crs=gdf.crs, index=gdf.index)
+    if gdf.crs is None:
+        gdf = gdf.set_crs(epsg=4326)
+    if simplify_tolerance and gdf.crs.is_projected:
+        gdf['geometry'] = gdf.geometry.simplify(simplify_tolerance, preserve_topology=True)
+    gdf = gdf.to_crs(epsg=4326)
     min_e = gdf['energy_kwh'].min()
     max_e = gdf['energy_kwh'].max()
     colormap = linear.YlOrRd_09.scale(min_e, max_e)
     colormap.caption = 'Potenziale FV (kWh/anno)'
-    centroid = gdf.geometry.centroid
-    m = folium.Map(location=[centroid.y.mean(), centroid.x.mean()], zoom_start=15, tiles='OpenStreetMap')
-    folium.GeoJson(
-        gdf,
-        name='Edifici (base)',
-        style_function=lambda feature: {
-            'fillColor': '#cccccc',
-            'color': '#666666',
-            'weight': 0.5,
-            'fillOpacity': 0.2,
-        },
-        tooltip=folium.GeoJsonTooltip(fields=[])
-    ).add_to(m)
-    folium.GeoJson(
-        gdf,
-        name='Potenziale FV',
-        style_function=lambda feature: {
-            'fillColor': colormap(feature['properties']['energy_kwh']),
-            'color': 'black',
-            'weight': 0.5,
-            'fillOpacity': 0.7,
-        },
-        tooltip=folium.GeoJsonTooltip(fields=['energy_kwh'], aliases=['Potenziale FV (kWh/anno)'])
-    ).add_to(m)
-    colormap.add_to(m)
+    # Colori calcolati una volta qui: lo style_function li legge soltanto
+    gdf['fill_color'] = [colormap(v) for v in energy]
+    minx, miny, maxx, maxy = gdf.total_bounds
+    m = folium.Map(location=[(miny + maxy) / 2, (minx + maxx) / 2], zoom_start=15, tiles='OpenStreetMap')
+    # Un solo layer GeoJSON: base grigia senza risultati, colorato per FV altrimenti
+    if results:
+        folium.GeoJson(
+            gdf,
+            name='Potenziale FV',
+            style_function=lambda feature: {
+                'fillColor': feature['properties']['fill_color'],
+                'color': 'black',
+                'weight': 0.5,
+                'fillOpacity': 0.7,
+            },
+            tooltip=folium.GeoJsonTooltip(fields=['energy_kwh'], aliases=['Potenziale FV (kWh/anno)'])
+        ).add_to(m)
+        colormap.add_to(m)
+    else:
+        folium.GeoJson(
+            gdf,
+            name='Edifici (base)',
+            style_function=lambda feature: {
+                'fillColor': '#cccccc',
+                'color': '#666666',
+                'weight': 0.5,
+                'fillOpacity': 0.2,
+            },
+        ).add_to(m)
     folium.LayerControl().add_to(m)
-    # Restituisci HTML come stringa
+    return m, min_e, max_e
+
+def plot_pv_potential_folium_html(gdf, results, simplify_tolerance=SIMPLIFY_TOLERANCE_M):
+    """
+    Crea una mappa Folium (vedi _build_folium_map) e restituisce l'HTML come stringa.
+    Args:
+        gdf: GeoDataFrame degli edifici
+        results: dict di risultati da process_all_buildings()
+        simplify_tolerance: Tolleranza di semplificazione in metri
+    Returns:
+        html: stringa HTML della mappa
+    """
+    m, _, _ = _build_folium_map(gdf, results, simplify_tolerance)
     return m.get_root().render()
 
-def plot_pv_potential_folium_file(gdf, results, output_html):
+def plot_pv_potential_folium_file(gdf, results, output_html, simplify_tolerance=SIMPLIFY_TOLERANCE_M):
     """
-    Crea una mappa Folium con due layer e salva su file HTML.
-    - Layer base: edifici originali (grigio, trasparente)
-    - Layer FV: edifici colorati per potenziale FV
+    Crea una mappa Folium (vedi _build_folium_map) e salva su file HTML.
     Args:
         gdf: GeoDataFrame degli edifici
         results: dict di risultati da process_all_buildings()
         output_html: percorso file HTML
+        simplify_tolerance: Tolleranza di semplificazione in metri
     """
-    gdf = gdf.copy()
-    gdf['energy_kwh'] = gdf.index.map(lambda idx: results.get(idx, {}).get('annual_metrics', {}).get('energy_kwh', 0))
-    min_e = gdf['energy_kwh'].min()
-    max_e = gdf['energy_kwh'].max()
-    colormap = linear.YlOrRd_09.scale(min_e, max_e)
-    colormap.caption = 'Potenziale FV (kWh/anno)'
-    centroid = gdf.geometry.centroid
-    m = folium.Map(location=[centroid.y.mean(), centroid.x.mean()], zoom_start=15, tiles='OpenStreetMap')
-    folium.GeoJson(
-        gdf,
-        name='Edifici (base)',
-        style_function=lambda feature: {
-            'fillColor': '#cccccc',
-            'color': '#666666',
-            'weight': 0.5,
-            'fillOpacity': 0.2,
-        },
-        tooltip=folium.GeoJsonTooltip(fields=[])
-    ).add_to(m)
-    folium.GeoJson(
-        gdf,
-        name='Potenziale FV',
-        style_function=lambda feature: {
-            'fillColor': colormap(feature['properties']['energy_kwh']),
-            'color': 'black',
-            'weight': 0.5,
-            'fillOpacity': 0.7,
-        },
-        tooltip=folium.GeoJsonTooltip(fields=['energy_kwh'], aliases=['Potenziale FV (kWh/anno)'])
-    ).add_to(m)
-    colormap.add_to(m)
-    folium.LayerControl().add_to(m)
+    m, min_e, max_e = _build_folium_map(gdf, results, simplify_tolerance)
     Path(output_html).parent.mkdir(parents=True, exist_ok=True)
     m.save(output_html)
     # Aggiunta di log per debug
@@ -13,17 +13,36 @@ Filosofia: Funzioni semplici, lazy loading, storage in-memory.
 """
 
 import math
+import os
 import json
+import logging
+import multiprocessing as mp
 import tempfile
 import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from datetime import datetime, timedelta
 
 import pandas as pd
 import geopandas as gpd
 import numpy as np
+import shapely
 from shapely.geometry import Point
 
+# orjson opzionale: serializzazione GeoJSON molto più veloce di json stdlib
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# pyogrio + pyarrow opzionali: lettura shapefile colonnare via Arrow (molto più veloce di Fiona)
+try:
+    import pyogrio  # noqa: F401
+    import pyarrow  # noqa: F401
+    _ARROW_READ = True
+except ImportError:
+    _ARROW_READ = False
+
 # Import dalle funzioni di pvgis_horizon_from_shapefile
 # (Adatteremo questi import in base a come rifattorezzi quel file)
 import sys
@@ -31,12 +50,16 @@ sys.path.insert(0, str(Path(__file__).parent))
 
 from pvgis_horizon_from_shapefile import (
     compute_userhorizon_from_gdf,
+    prepare_horizon_context,
     compute_panel_orientation,
+    compute_panel_orientation_batch,
     estimate_peak_power,
+    estimate_peak_power_batch,
     estimate_height_attr,
     lonlat_to_utm_epsg,
     call_pvgis_seriescalc,
     extract_zip_find_shp,
+    list_zip_shp,
     pick_building_shp,
     STEP_DEG,
     RAY_LENGTH_M,
@@ -44,6 +67,76 @@ from pvgis_horizon_from_shapefile import (
     DEFAULT_TILT_FOR_ASPECT,
 )
 
+# Messaggi degli update on-demand (silenziabili nei run batch con logging.getLogger)
+logger = logging.getLogger(__name__)
+
+# Worker per le chiamate PVGIS in parallelo (I/O bound; limitato per il rate limit)
+MAX_WORKERS = 8
+
+# Colonne orarie PVGIS in float32: precisione ampiamente sufficiente (modello FV ~1%),
+# metà memoria; le somme si accumulano comunque in float64
+HOURLY_DTYPES = {
+    'P': 'float32', 'Gb(i)': 'float32', 'Gd(i)': 'float32', 'Gr(i)': 'float32',
+    'G(i)': 'float32', 'H_sun': 'float32', 'T2m': 'float32', 'WS10m': 'float32',
+}
+
+# Export GeoJSON: sotto questa soglia di feature il pool di processi non conviene
+PARALLEL_EXPORT_MIN_FEATURES = 50000
+
+# Horizon di distretto: sotto questa soglia bastano i thread di process_all_buildings
+# (l'avvio dei processi spawn e la copia del gdf costano qualche secondo)
+PARALLEL_HORIZON_MIN_BUILDINGS = 5000
+
+# Decimali delle coordinate nell'export GeoJSON (gradi; 6 ≈ 0.1 m, sufficiente per Leaflet)
+GEOJSON_COORD_PRECISION = 6
+
+# Classi capacity factor per Leaflet: soglie (estremo inferiore incluso) -> colore/categoria
+CF_BINS = np.array([0.10, 0.15, 0.20])
+CF_COLORS = np.array(["#E74C3C", "#E67E22", "#F1C40F", "#2ECC71"])
+CF_CATEGORIES = np.array(["very_low", "low", "medium", "high"])
+# Frammento JSON già pronto per ogni classe (indicizzato come CF_COLORS/CF_CATEGORIES)
+CF_BIN_LUT = tuple(
+    '"cf_category":"%s","color":"%s"' % (cat, color) for cat, color in zip(CF_CATEGORIES, CF_COLORS)
+)
+
+# Feature GeoJSON compatta come template: niente dict né encoder JSON per feature
+_FEATURE_TEMPLATE = (
+    '{"type":"Feature","geometry":%s,"properties":{"building_id":%d,'
+    '"energy_kwh":%s,"capacity_factor":%s,%s,"popup_text":%s}}'
+)
+
+
+# ============================================================
+# UTILITÀ CRS
+# ============================================================
+
+def estimate_utm_epsg(gdf) -> int:
+    """
+    EPSG UTM della zona in cui cade il layer.
+    Usa il punto medio di total_bounds (4 float) invece di union_all().centroid,
+    che su migliaia di poligoni costa un'unione O(N).
+    
+    Args:
+        gdf: GeoDataFrame con CRS definito
+    
+    Returns:
+        int: EPSG code UTM
+    """
+    minx, miny, maxx, maxy = gdf.total_bounds
+    mid = Point((minx + maxx) / 2, (miny + maxy) / 2)
+    mid_ll = gpd.GeoSeries([mid], crs=gdf.crs).to_crs(epsg=4326).iloc[0]
+    return lonlat_to_utm_epsg(mid_ll.x, mid_ll.y)
+
+
+def read_buildings(path) -> gpd.GeoDataFrame:
+    """
+    Legge lo shapefile edifici; usa pyogrio con use_arrow se disponibile.
+    Tutte le colonne vengono lette (servono per l'altezza degli edifici).
+    """
+    if _ARROW_READ:
+        return gpd.read_file(path, engine='pyogrio', use_arrow=True)
+    return gpd.read_file(path)
+
 
 # ============================================================
 # METRICHE ANNUALI
@@ -72,16 +165,16 @@ def compute_annual_metrics(df_hourly: pd.DataFrame, peakpower_kwp: float) -> dic
             'num_hours': 0
         }
     
-    power_w = df_hourly['P'].values
+    power_w = df_hourly['P'].to_numpy(dtype=np.float32)
     
-    # Energia totale annua (Wh → kWh)
-    energy_wh = power_w.sum()
+    # Energia totale annua (Wh → kWh); la media deriva dalla somma (niente passaggio extra)
+    energy_wh = float(power_w.sum(dtype=np.float64))
     energy_kwh = energy_wh / 1000.0
     
     # Potenza media/max/min
-    avg_power_w = float(np.mean(power_w))
-    max_power_w = float(np.max(power_w))
-    min_power_w = float(np.min(power_w))
+    avg_power_w = energy_wh / power_w.size
+    max_power_w = float(power_w.max())
+    min_power_w = float(power_w.min())
     
     # Capacity Factor = Energia reale / (Potenza nominale × 8760 ore)
     nominal_annual_kwh = peakpower_kwp * 8760
@@ -105,6 +198,43 @@ def compute_annual_metrics(df_hourly: pd.DataFrame, peakpower_kwp: float) -> dic
     }
 
 
+def hourly_frame(hourly: list) -> pd.DataFrame:
+    """
+    DataFrame orario dalla lista grezza PVGIS, colonne numeriche in float32 (HOURLY_DTYPES).
+    
+    Args:
+        hourly: pvgis_json['outputs']['hourly']
+    
+    Returns:
+        DataFrame (time resta stringa)
+    """
+    if not hourly:
+        return pd.DataFrame(hourly)
+    # Colonna per colonna con dtype noto: niente inferenza né passaggio da float64
+    n = len(hourly)
+    cols = {}
+    for k in hourly[0]:
+        if k in HOURLY_DTYPES:
+            cols[k] = np.fromiter((h[k] for h in hourly), dtype=HOURLY_DTYPES[k], count=n)
+        else:
+            cols[k] = [h[k] for h in hourly]
+    return pd.DataFrame(cols, copy=False)
+
+
+def hourly_energy_kwh(hourly: list) -> float:
+    """
+    Energia totale (kWh) dalla lista oraria grezza PVGIS, senza costruire un DataFrame.
+    
+    Args:
+        hourly: pvgis_json['outputs']['hourly'] (lista di dict con chiave 'P' in W)
+    
+    Returns:
+        float: somma di P / 1000
+    """
+    power_w = np.fromiter((h['P'] for h in hourly), dtype=np.float64, count=len(hourly))
+    return float(power_w.sum()) / 1000.0
+
+
 # ============================================================
 # GIORNI BEST & WORST
 # ============================================================
@@ -126,13 +256,12 @@ def compute_best_worst_days(df_hourly: pd.DataFrame) -> dict:
         }
     
     # Parse time: PVGIS format è YYYYMMDD:HHMM (e.g., "20200101:0011")
-    df_hourly = df_hourly.copy()
     try:
-        df_hourly['datetime'] = pd.to_datetime(df_hourly['time'], format='%Y%m%d:%H%M')
+        dt = pd.to_datetime(df_hourly['time'], format='%Y%m%d:%H%M', cache=True)
     except Exception as e:
         print(f"Warning: Could not parse time with format '%Y%m%d:%H%M'. Trying alternative formats. Error: {e}")
         try:
-            df_hourly['datetime'] = pd.to_datetime(df_hourly['time'])
+            dt = pd.to_datetime(df_hourly['time'], cache=True)
         except:
             print(f"ERROR: Could not parse time column at all")
             return {
@@ -140,43 +269,47 @@ def compute_best_worst_days(df_hourly: pd.DataFrame) -> dict:
                 'worst': {'date': None, 'energy_kwh': 0.0, 'profile': []}
             }
     
-    df_hourly['date'] = df_hourly['datetime'].dt.date
+    # Lavora su array numpy: giorno come datetime64[D] (niente oggetti date Python)
+    t = dt.to_numpy()
+    power_w = df_hourly['P'].to_numpy(dtype=np.float32)
+    # PVGIS restituisce la serie già in ordine temporale: ordina solo se serve
+    if not dt.is_monotonic_increasing:
+        order = np.argsort(t, kind='stable')
+        t = t[order]
+        power_w = power_w[order]
+    day = t.astype('datetime64[D]')
     
-    # Raggruppa per giorno e somma energia
-    daily_energy = df_hourly.groupby('date')['P'].agg(['sum', 'count'])
-    daily_energy.columns = ['energy_wh', 'count']
-    daily_energy['energy_kwh'] = daily_energy['energy_wh'] / 1000.0
+    # Raggruppa per giorno e somma energia (un solo passaggio sui dati ordinati)
+    days, starts, counts = np.unique(day, return_index=True, return_counts=True)
+    daily_energy_kwh = np.add.reduceat(power_w, starts, dtype=np.float64) / 1000.0
     
     # Filtra giorni completi (24 ore)
-    daily_energy = daily_energy[daily_energy['count'] == 24]
+    complete = np.flatnonzero(counts == 24)
     
-    if daily_energy.empty:
+    if complete.size == 0:
         return {
             'best': {'date': None, 'energy_kwh': 0.0, 'profile': []},
             'worst': {'date': None, 'energy_kwh': 0.0, 'profile': []}
         }
     
     # Best e worst day
-    best_date = daily_energy['energy_kwh'].idxmax()
-    worst_date = daily_energy['energy_kwh'].idxmin()
-    
-    best_energy = daily_energy.loc[best_date, 'energy_kwh']
-    worst_energy = daily_energy.loc[worst_date, 'energy_kwh']
+    best_i = complete[np.argmax(daily_energy_kwh[complete])]
+    worst_i = complete[np.argmin(daily_energy_kwh[complete])]
     
-    # Estrai profili orari
-    best_profile = df_hourly[df_hourly['date'] == best_date].sort_values('datetime')['P'].tolist()
-    worst_profile = df_hourly[df_hourly['date'] == worst_date].sort_values('datetime')['P'].tolist()
+    # Estrai profili orari: slice contigua dei dati già ordinati
+    best_profile = power_w[starts[best_i]:starts[best_i] + 24]
+    worst_profile = power_w[starts[worst_i]:starts[worst_i] + 24]
     
     return {
         'best': {
-            'date': str(best_date),
-            'energy_kwh': round(best_energy, 2),
-            'profile': [round(p, 2) for p in best_profile]
+            'date': str(days[best_i]),
+            'energy_kwh': round(float(daily_energy_kwh[best_i]), 2),
+            'profile': [round(p, 2) for p in best_profile.tolist()]
         },
         'worst': {
-            'date': str(worst_date),
-            'energy_kwh': round(worst_energy, 2),
-            'profile': [round(p, 2) for p in worst_profile]
+            'date': str(days[worst_i]),
+            'energy_kwh': round(float(daily_energy_kwh[worst_i]), 2),
+            'profile': [round(p, 2) for p in worst_profile.tolist()]
         }
     }
 
@@ -191,11 +324,13 @@ def compute_tilt_sensitivity(
     userhorizon_str: str,
     aspect_deg: float,
     peakpower_kwp: float,
-    tilt_values: list = None
+    tilt_values: list = None,
+    max_workers: int = None,
+    use_cache: bool = True
 ) -> dict:
     """
     Calcola energia per diversi valori di tilt.
-    Richiede N call a PVGIS.
+    Richiede N call a PVGIS, eseguite in parallelo (I/O bound).
     
     Args:
         lat, lon: Coordinate
@@ -203,6 +338,8 @@ def compute_tilt_sensitivity(
         aspect_deg: Aspetto del pannello (PVGIS format)
         peakpower_kwp: Potenza nominale
         tilt_values: Lista di tilt da testare [default: [15, 20, 25, 30, 35]]
+        max_workers: Chiamate PVGIS contemporanee [default: una per tilt, max MAX_WORKERS]
+        use_cache: Riusa le risposte PVGIS in cache (es. lo scenario base con lo stesso tilt)
     
     Returns:
         dict con risultati sensibilità e tilt ottimale
@@ -211,33 +348,50 @@ def compute_tilt_sensitivity(
         tilt_values = [15, 20, 25, 30, 35]
     
     tilt_values = sorted(tilt_values)
-    energy_values = []
+    energy_values = [0.0] * len(tilt_values)
+    if max_workers is None:
+        max_workers = min(len(tilt_values), MAX_WORKERS)
     
     print(f"\n[TILT SENSITIVITY] Computing {len(tilt_values)} scenarios...")
     
-    for tilt in tilt_values:
-        print(f"  - Tilt {tilt}°...", end=' ', flush=True)
-        try:
-            pvgis_json = call_pvgis_seriescalc(
-                lat, lon,
-                userhorizon_str,
-                peakpower_kwp,
-                tilt=tilt,
-                aspect=aspect_deg
-            )
-            
-            if 'outputs' in pvgis_json and 'hourly' in pvgis_json['outputs']:
-                df = pd.DataFrame(pvgis_json['outputs']['hourly'])
-                energy_kwh = (df['P'].sum() / 1000.0)
-                energy_values.append(energy_kwh)
-                print(f"{energy_kwh:.0f} kWh")
-            else:
-                energy_values.append(0.0)
-                print("ERROR")
-        except Exception as e:
-            print(f"FAILED: {e}")
-            energy_values.append(0.0)
-    
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = {
+            pool.submit(_tilt_energy, lat, lon, userhorizon_str, aspect_deg, peakpower_kwp,
+                        tilt, use_cache): i
+            for i, tilt in enumerate(tilt_values)
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                energy_kwh = future.result()
+                if energy_kwh is None:
+                    print(f"  - Tilt {tilt_values[i]}°... ERROR")
+                else:
+                    energy_values[i] = energy_kwh
+                    print(f"  - Tilt {tilt_values[i]}°... {energy_kwh:.0f} kWh")
+            except Exception as e:
+                print(f"  - Tilt {tilt_values[i]}°... FAILED: {e}")
+    
+    return _summarize_tilt_sensitivity(tilt_values, energy_values)
+
+
+def _tilt_energy(lat, lon, userhorizon_str, aspect_deg, peakpower_kwp, tilt, use_cache=True):
+    """Energia annua (kWh) per un singolo tilt; None se PVGIS non restituisce la serie."""
+    pvgis_json = call_pvgis_seriescalc(
+        lat, lon,
+        userhorizon_str,
+        peakpower_kwp,
+        tilt=tilt,
+        aspect=aspect_deg,
+        use_cache=use_cache
+    )
+    if 'outputs' in pvgis_json and 'hourly' in pvgis_json['outputs']:
+        return hourly_energy_kwh(pvgis_json['outputs']['hourly'])
+    return None
+
+
+def _summarize_tilt_sensitivity(tilt_values: list, energy_values: list) -> dict:
+    """Dict tilt_sensitivity da tilt ordinati ed energie corrispondenti (0.0 = fallito)."""
     # Trova tilt ottimale
     if energy_values and any(e > 0 for e in energy_values):
         optimal_idx = np.argmax(energy_values)
@@ -299,8 +453,7 @@ def compute_horizon_impact(
         )
         
         if 'outputs' in pvgis_json and 'hourly' in pvgis_json['outputs']:
-            df = pd.DataFrame(pvgis_json['outputs']['hourly'])
-            energy_without_kwh = (df['P'].sum() / 1000.0)
+            energy_without_kwh = hourly_energy_kwh(pvgis_json['outputs']['hourly'])
         else:
             energy_without_kwh = energy_with_horizon_kwh
     except Exception as e:
@@ -328,7 +481,14 @@ def process_building(
     building_idx: int,
     utm_epsg: int = None,
     compute_horizon_impact_flag: bool = False,
-    existing_results: dict = None
+    existing_results: dict = None,
+    lat_pt: float = None,
+    lon_pt: float = None,
+    keep_raw: bool = False,
+    horizon_context: dict = None,
+    orientation_results: dict = None,
+    peak_power: tuple = None,
+    horizon: tuple = None
 ) -> dict:
     """
     Processa UN edificio: horizon, orientation, PVGIS call, metriche.
@@ -339,6 +499,18 @@ def process_building(
         utm_epsg: EPSG code (se None, calcola da centroid)
         compute_horizon_impact_flag: Se True, calcola impatto horizon (+1 call)
         existing_results: dict esistente per cache check (evita riprocessare)
+        lat_pt, lon_pt: Centroide in EPSG:4326 già calcolato (da process_all_buildings);
+            se None viene riproiettato qui
+        keep_raw: Se True, conserva df_hourly e risposta PVGIS grezza in result['_internal']
+            (8760 righe per edificio: lasciare False salvo analisi specifiche)
+        horizon_context: dati di distretto da prepare_horizon_context(gdf)
+            (da process_all_buildings; se None vengono calcolati qui)
+        orientation_results: orientamento già calcolato (da compute_panel_orientation_batch);
+            se None viene calcolato qui
+        peak_power: (peakpower_kwp, area_m2) già stimati (da estimate_peak_power_batch);
+            se None vengono stimati qui
+        horizon: risultato di compute_userhorizon_from_gdf già calcolato
+            (da compute_district_horizons); se None viene calcolato qui
     
     Returns:
         dict con risultati completi dell'edificio, o None se già processato
@@ -354,29 +526,33 @@ def process_building(
     print(f"\n--- Processing Building {building_idx} ---")
     
     # 1. Calcola horizon e orientation
-    print("  Computing horizon...")
-    horizon_items, horizon_degrees, centroid, target_height = compute_userhorizon_from_gdf(
-        gdf, target_idx=building_idx, step_deg=STEP_DEG, ray_length=RAY_LENGTH_M
-    )
+    if horizon is None:
+        print("  Computing horizon...")
+        horizon = compute_userhorizon_from_gdf(
+            gdf, target_idx=building_idx, step_deg=STEP_DEG, ray_length=RAY_LENGTH_M,
+            context=horizon_context
+        )
+    horizon_items, horizon_degrees, centroid, target_height = horizon
     userhorizon_str = ','.join(str(d) for d in horizon_degrees)
     
-    print("  Computing orientation...")
     target_geom = gdf.iloc[building_idx].geometry
-    orientation_results = compute_panel_orientation(target_geom)
+    if orientation_results is None:
+        print("  Computing orientation...")
+        orientation_results = compute_panel_orientation(target_geom)
     
-    print("  Estimating peak power...")
-    peakpower_kwp, area_m2 = estimate_peak_power(target_geom)
+    if peak_power is None:
+        print("  Estimating peak power...")
+        peak_power = estimate_peak_power(target_geom)
+    peakpower_kwp, area_m2 = peak_power
     
     # 2. Converti centroid a lat/lon
     if utm_epsg is None:
-        gdf_ll = gdf.to_crs(epsg=4326)
-        rep_point = gdf_ll.union_all().centroid
-        lon_temp, lat_temp = rep_point.x, rep_point.y
-        utm_epsg = lonlat_to_utm_epsg(lon_temp, lat_temp)
+        utm_epsg = estimate_utm_epsg(gdf)
     
-    centroid_ll = gpd.GeoSeries([centroid], crs=f"EPSG:{utm_epsg}").to_crs(epsg=4326).iloc[0]
-    lat_pt = centroid_ll.y
-    lon_pt = centroid_ll.x
+    if lat_pt is None or lon_pt is None:
+        centroid_ll = gpd.GeoSeries([centroid], crs=f"EPSG:{utm_epsg}").to_crs(epsg=4326).iloc[0]
+        lat_pt = centroid_ll.y
+        lon_pt = centroid_ll.x
     
     # 3. Chiama PVGIS (base, con horizon)
     print("  Calling PVGIS seriescalc...")
@@ -390,7 +566,7 @@ def process_building(
             aspect=pvgis_aspect
         )
         
-        df_hourly = pd.DataFrame(pvgis_json['outputs']['hourly'])
+        df_hourly = hourly_frame(pvgis_json['outputs']['hourly'])
     except Exception as e:
         print(f"  ERROR: PVGIS call failed: {e}")
         return None
@@ -431,14 +607,14 @@ def process_building(
         # On-demand (lazy load)
         'tilt_sensitivity': None,
         'horizon_impact': None,
-        
-        # Metadata
-        '_internal': {
-            'df_hourly': df_hourly,  # Mantieni per eventuali analisi future
+    }
+    
+    # Dati grezzi solo su richiesta: trattenerli per N edifici occupa centinaia di MB
+    if keep_raw:
+        result['_internal'] = {
+            'df_hourly': df_hourly,
             'pvgis_json': pvgis_json,
-            'gdf': gdf
         }
-    }
     
     # 6. [Opzionale] Calcola horizon impact se richiesto
     if compute_horizon_impact_flag:
@@ -460,18 +636,80 @@ def process_building(
 # PROCESSING TUTTI GLI EDIFICI
 # ============================================================
 
+# Stato dei processi worker di compute_district_horizons (impostato da _init_horizon_worker)
+_WORKER_GDF = None
+_WORKER_CONTEXT = None
+
+
+def _init_horizon_worker(gdf):
+    """Initializer del pool: il gdf arriva una volta per processo, il contesto si costruisce lì."""
+    global _WORKER_GDF, _WORKER_CONTEXT
+    _WORKER_GDF = gdf
+    _WORKER_CONTEXT = prepare_horizon_context(gdf)
+
+
+def _horizon_chunk(positions) -> list:
+    """Worker di compute_district_horizons: horizon di un blocco di edifici (None se fallisce)."""
+    out = []
+    for idx in positions:
+        try:
+            out.append(compute_userhorizon_from_gdf(
+                _WORKER_GDF, target_idx=idx, step_deg=STEP_DEG, ray_length=RAY_LENGTH_M,
+                context=_WORKER_CONTEXT
+            ))
+        except Exception:
+            out.append(None)
+    return out
+
+
+def compute_district_horizons(gdf, positions=None, workers: int = None) -> dict:
+    """
+    Horizon (compute_userhorizon_from_gdf) di molti edifici su un pool di processi:
+    il calcolo è solo CPU e indipendente per edificio. Ogni worker riceve il gdf
+    una volta sola e ricostruisce localmente STRtree e altezze (prepare_horizon_context).
+    
+    Args:
+        gdf: GeoDataFrame (in CRS metrico UTM)
+        positions: indici posizionali degli edifici (default: tutti)
+        workers: numero di processi (default: os.cpu_count())
+    
+    Returns:
+        dict {idx: (horizon_items, horizon_degrees, centroid, target_height)};
+        gli edifici con errore non compaiono (process_building li ricalcola e segnala)
+    """
+    positions = list(range(len(gdf))) if positions is None else list(positions)
+    n_procs = max(1, min(workers or os.cpu_count() or 1, len(positions)))
+    if not positions:
+        return {}
+    
+    bounds = np.linspace(0, len(positions), n_procs * 4 + 1).astype(int)
+    chunks = [positions[a:b] for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+    
+    # spawn: niente fork di un processo con GDAL/GEOS già inizializzati
+    with mp.get_context('spawn').Pool(n_procs, initializer=_init_horizon_worker, initargs=(gdf,)) as pool:
+        horizons = [h for chunk in pool.imap(_horizon_chunk, chunks) for h in chunk]
+    
+    return {idx: h for idx, h in zip(positions, horizons) if h is not None}
+
+
 def process_all_buildings(
     gdf,
     compute_horizon_impact_all: bool = False,
-    existing_results: dict = None
+    existing_results: dict = None,
+    max_workers: int = MAX_WORKERS,
+    keep_raw: bool = False
 ) -> dict:
     """
     Loop su tutti gli edifici in GDF. Usa cache se available.
+    Gli edifici vengono processati in parallelo su un pool di thread:
+    il tempo è dominato dalle chiamate HTTP a PVGIS.
     
     Args:
         gdf: GeoDataFrame (in CRS metrico UTM)
         compute_horizon_impact_all: Se True, calcola horizon impact per tutti
         existing_results: dict di risultati già processati (per evitare riprocessare)
+        max_workers: Numero massimo di edifici processati in contemporanea
+        keep_raw: Passato a process_building (conserva i dati orari grezzi)
     
     Returns:
         dict: {0: {result}, 1: {result}, ...}
@@ -480,29 +718,66 @@ def process_all_buildings(
         existing_results = {}
     
     results = existing_results.copy()
-    utm_epsg = None
     
     # Calcola EPSG una volta
-    gdf_ll = gdf.to_crs(epsg=4326)
-    rep_point = gdf_ll.union_all().centroid
-    lon_temp, lat_temp = rep_point.x, rep_point.y
-    utm_epsg = lonlat_to_utm_epsg(lon_temp, lat_temp)
+    utm_epsg = estimate_utm_epsg(gdf)
     
+    # Dati di distretto (STRtree, altezze, centroidi) calcolati una volta per tutti gli edifici
+    horizon_context = prepare_horizon_context(gdf)
+    
+    # Centroidi di tutti gli edifici in lat/lon: una sola riproiezione
+    centroids_ll = gpd.GeoSeries(
+        shapely.points(horizon_context['centroids_xy']), crs=gdf.crs
+    ).to_crs(epsg=4326)
+    lons = centroids_ll.x.to_numpy()
+    lats = centroids_ll.y.to_numpy()
+    
+    todo = []
     for idx in range(len(gdf)):
-        try:
-            result = process_building(
+        if results.get(idx) is not None:
+            print(f"--- Building {idx} (cached, skipping) ---")
+            continue
+        todo.append(idx)
+    
+    # Orientamento e potenza di picco di tutti gli edifici da processare in un colpo solo (numpy)
+    todo_geoms = gdf.geometry.values[todo]
+    orientations = dict(zip(todo, compute_panel_orientation_batch(todo_geoms)))
+    peak_kwp, peak_area = estimate_peak_power_batch(todo_geoms)
+    peak_powers = {idx: (float(kwp), float(area)) for idx, kwp, area in zip(todo, peak_kwp, peak_area)}
+    
+    # Distretti grandi: horizon (solo CPU) precalcolato su tutti i core
+    horizons = {}
+    if len(todo) >= PARALLEL_HORIZON_MIN_BUILDINGS and (os.cpu_count() or 1) > 1:
+        horizons = compute_district_horizons(gdf, todo)
+    
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = {
+            pool.submit(
+                process_building,
                 gdf, idx,
                 utm_epsg=utm_epsg,
                 compute_horizon_impact_flag=compute_horizon_impact_all,
-                existing_results=results
-            )
-            if result:
-                results[idx] = result
-        except Exception as e:
-            print(f"ERROR processing building {idx}: {e}")
-            results[idx] = None
-    
-    return results
+                lat_pt=float(lats[idx]),
+                lon_pt=float(lons[idx]),
+                keep_raw=keep_raw,
+                horizon_context=horizon_context,
+                orientation_results=orientations[idx],
+                peak_power=peak_powers[idx],
+                horizon=horizons.get(idx)
+            ): idx
+            for idx in todo
+        }
+        for future in as_completed(futures):
+            idx = futures[future]
+            try:
+                result = future.result()
+                if result:
+                    results[idx] = result
+            except Exception as e:
+                print(f"ERROR processing building {idx}: {e}")
+                results[idx] = None
+    
+    return dict(sorted(results.items()))
 
 
 # ============================================================
@@ -513,20 +788,24 @@ def add_tilt_sensitivity_to_building(
     results: dict,
     building_idx: int,
     gdf,
-    tilt_values: list = None
+    tilt_values: list = None,
+    max_workers: int = None,
+    use_cache: bool = True
 ) -> None:
     """
     Aggiunge analisi sensibilità tilt a un edificio specifico (in-place).
-    Richiede N call aggiuntive a PVGIS.
+    Richiede N call aggiuntive a PVGIS (in parallelo).
     
     Args:
         results: Dict di risultati (da process_all_buildings)
         building_idx: Indice edificio
         gdf: GeoDataFrame (per riferimento CRS)
         tilt_values: Lista tilt da testare
+        max_workers: Chiamate PVGIS contemporanee (vedi compute_tilt_sensitivity)
+        use_cache: Riusa le risposte PVGIS in cache (vedi call_pvgis_seriescalc)
     """
     if building_idx not in results or results[building_idx] is None:
-        print(f"ERROR: Building {building_idx} not found in results")
+        logger.error("Building %s not found in results", building_idx)
         return
     
     if tilt_values is None:
@@ -547,13 +826,75 @@ def add_tilt_sensitivity_to_building(
         userhorizon_str,
         aspect_deg,
         peakpower_kwp,
-        tilt_values
+        tilt_values,
+        max_workers=max_workers,
+        use_cache=use_cache
     )
     
     # Aggiorna in-place
     results[building_idx]['tilt_sensitivity'] = tilt_sensitivity
 
 
+def add_tilt_sensitivity_to_all(
+    results: dict,
+    gdf,
+    tilt_values: list = None,
+    max_workers: int = MAX_WORKERS,
+    use_cache: bool = True
+) -> None:
+    """
+    Aggiunge la sensibilità tilt a tutti gli edifici validi (in-place).
+    Tutte le N×len(tilt_values) call PVGIS passano da un unico pool di thread
+    (invece di un pool per edificio come in add_tilt_sensitivity_to_building).
+    
+    Args:
+        results: Dict di risultati (da process_all_buildings)
+        gdf: GeoDataFrame (per riferimento CRS)
+        tilt_values: Lista tilt da testare
+        max_workers: Chiamate PVGIS contemporanee
+        use_cache: Riusa le risposte PVGIS in cache (vedi call_pvgis_seriescalc)
+    """
+    if tilt_values is None:
+        tilt_values = [15, 20, 25, 30, 35]
+    tilt_values = sorted(tilt_values)
+    
+    targets = [idx for idx, r in results.items() if r is not None]
+    energies = {idx: [0.0] * len(tilt_values) for idx in targets}
+    
+    print(f"\n[TILT SENSITIVITY] Computing {len(tilt_values)} scenarios "
+          f"for {len(targets)} buildings...")
+    
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = {}
+        for idx in targets:
+            building_data = results[idx]
+            for i, tilt in enumerate(tilt_values):
+                future = pool.submit(
+                    _tilt_energy,
+                    building_data['location']['lat'],
+                    building_data['location']['lon'],
+                    building_data['userhorizon_str'],
+                    building_data['building_props']['aspect_deg'],
+                    building_data['building_props']['peakpower_kwp'],
+                    tilt, use_cache
+                )
+                futures[future] = (idx, i)
+        for future in as_completed(futures):
+            idx, i = futures[future]
+            try:
+                energy_kwh = future.result()
+                if energy_kwh is None:
+                    print(f"  - Building {idx}, tilt {tilt_values[i]}°... ERROR")
+                else:
+                    energies[idx][i] = energy_kwh
+            except Exception as e:
+                print(f"  - Building {idx}, tilt {tilt_values[i]}°... FAILED: {e}")
+    
+    # Aggiorna in-place
+    for idx in targets:
+        results[idx]['tilt_sensitivity'] = _summarize_tilt_sensitivity(tilt_values, energies[idx])
+
+
 def add_horizon_impact_to_building(
     results: dict,
     building_idx: int,
@@ -569,14 +910,14 @@ def add_horizon_impact_to_building(
         gdf: GeoDataFrame (per riferimento)
     """
     if building_idx not in results or results[building_idx] is None:
-        print(f"ERROR: Building {building_idx} not found in results")
+        logger.error("Building %s not found in results", building_idx)
         return
     
     building_data = results[building_idx]
     
     # Se già calcolato, skip
     if building_data['horizon_impact'] is not None:
-        print(f"Building {building_idx} already has horizon_impact computed")
+        logger.info("Building %s already has horizon_impact computed", building_idx)
         return
     
     # Estrai parametri
@@ -601,60 +942,356 @@ def add_horizon_impact_to_building(
     results[building_idx]['horizon_impact'] = horizon_impact
 
 
+def add_horizon_impact_to_all(
+    results: dict,
+    gdf,
+    max_workers: int = MAX_WORKERS
+) -> None:
+    """
+    Aggiunge l'impatto horizon a tutti gli edifici validi che non lo hanno (in-place).
+    Una call PVGIS per edificio, in parallelo.
+    
+    Args:
+        results: Dict di risultati
+        gdf: GeoDataFrame (per riferimento)
+        max_workers: Chiamate PVGIS contemporanee
+    """
+    targets = [
+        idx for idx, r in results.items()
+        if r is not None and r.get('horizon_impact') is None
+    ]
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        # ogni task scrive solo results[idx]['horizon_impact'] del proprio edificio
+        for future in as_completed([
+            pool.submit(add_horizon_impact_to_building, results, idx, gdf) for idx in targets
+        ]):
+            future.result()
+
+
 # ============================================================
 # EXPORT GEOJSON PER LEAFLET
 # ============================================================
 
 # pvgis_analyzer.py
-def export_geojson_for_leaflet(gdf, results: dict, output_path: str = 'buildings_pv_potential.geojson') -> None:
-    # Leaflet vuole EPSG:4326
-    gdf_ll = gdf.to_crs(epsg=4326)
+def _json_bytes(obj, pretty: bool = False) -> bytes:
+    """Serializza obj in JSON compatto, o indentato con pretty=True (orjson se disponibile)."""
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY | (orjson.OPT_INDENT_2 if pretty else 0)
+        return orjson.dumps(obj, option=option)
+    if pretty:
+        return json.dumps(obj, indent=2).encode('utf-8')
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def _drop_empty(properties: dict) -> dict:
+    """Toglie le proprietà None/NaN (colonne morte nel GeoJSON)."""
+    return {
+        k: v for k, v in properties.items()
+        if v is not None and not (isinstance(v, float) and math.isnan(v))
+    }
+
+
+def _build_feature_chunk(args) -> list:
+    """
+    Costruisce i bytes JSON di un blocco di feature, nello stesso ordine.
+    Funzione top-level per poter girare in un worker (multiprocessing, spawn).
+    """
+    ids, geom_json, energies_r, cfs_r, cat_ids, popups, pretty = args
     features = []
-    for idx in gdf_ll.index:
-        if idx not in results or results[idx] is None:
+    # Lookup globali/attributi risolti una volta sola, fuori dal loop
+    features_append = features.append
+    template, lut, dumps, isnan = _FEATURE_TEMPLATE, CF_BIN_LUT, json.dumps, math.isnan
+    for idx, geom, energy, cf, cat, popup in zip(ids, geom_json, energies_r, cfs_r, cat_ids, popups):
+        energy, cf = float(energy), float(cf)
+        if not pretty and not (isnan(energy) or isnan(cf)):
+            # Caso normale: template (repr(float) = stessa resa di json/orjson)
+            features_append((template % (
+                geom, int(idx), repr(energy), repr(cf), lut[cat], dumps(popup)
+            )).encode('utf-8'))
             continue
-        geom = gdf_ll.loc[idx, 'geometry']
-        energy_kwh = results[idx]['annual_metrics']['energy_kwh']
-        cf = results[idx]['annual_metrics']['capacity_factor']
-        if cf >= 0.20:
-            color, category = "#2ECC71", "high"
-        elif cf >= 0.15:
-            color, category = "#F1C40F", "medium"
-        elif cf >= 0.10:
-            color, category = "#E67E22", "low"
-        else:
-            color, category = "#E74C3C", "very_low"
-        features.append({
-            "type":"Feature",
-            "geometry": json.loads(gdf_ll.loc[[idx]].to_json())["features"][0]["geometry"],
-            "properties":{
-                "building_id": int(idx),
-                "energy_kwh": round(energy_kwh,2),
-                "capacity_factor": round(cf,4),
-                "cf_category": category,
-                "color": color,
-                "popup_text": f"Building {idx}: {energy_kwh:.0f} kWh/year, CF {cf*100:.1f}%"
-            }
+        properties = _drop_empty({
+            "building_id": int(idx),
+            "energy_kwh": energy,
+            "capacity_factor": cf,
+            "cf_category": str(CF_CATEGORIES[cat]),
+            "color": str(CF_COLORS[cat]),
+            "popup_text": popup
         })
-    geojson = {"type":"FeatureCollection", "features": features}
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(geojson, f, indent=2)
+        if pretty:
+            feature = _json_bytes({
+                "type": "Feature",
+                "geometry": json.loads(geom),
+                "properties": properties
+            }, pretty=True)
+        else:
+            feature = (b'{"type":"Feature","geometry":' + geom.encode('utf-8')
+                       + b',"properties":' + _json_bytes(properties) + b'}')
+        features_append(feature)
+    return features
+
+
+def _annual_metrics_frame(results) -> pd.DataFrame:
+    """
+    Tabella colonnare (una riga per edificio valido) delle metriche annuali.
+    Accetta il dict {idx: result} o direttamente il DataFrame di results_to_dataframe.
+    """
+    if isinstance(results, pd.DataFrame):
+        return results
+    valid = {idx: r['annual_metrics'] for idx, r in results.items() if r is not None}
+    return pd.DataFrame.from_dict(valid, orient='index')
+
+
+def export_geojson_for_leaflet(
+    gdf,
+    results,
+    output_path: str = 'buildings_pv_potential.geojson',
+    ndjson: bool = False,
+    pretty: bool = False,
+    parallel: bool = True,
+    coord_precision: int = GEOJSON_COORD_PRECISION
+) -> None:
+    """
+    Esporta gli edifici analizzati per Leaflet (EPSG:4326).
+    Le feature vengono scritte su file una alla volta (niente lista in memoria),
+    in JSON compatto; proprietà None/NaN omesse.
+    
+    Args:
+        gdf: GeoDataFrame edifici
+        results: dict {idx: result} da process_all_buildings,
+                 oppure il DataFrame di results_to_dataframe
+        output_path: file di output
+        ndjson: True = GeoJSON line-delimited (una feature per riga),
+                False = FeatureCollection (una feature per riga dentro "features")
+        pretty: indenta ogni feature (solo per debug: file molto più grande)
+        parallel: costruisce le feature in un pool di processi
+                  (solo oltre PARALLEL_EXPORT_MIN_FEATURES edifici)
+        coord_precision: decimali delle coordinate (None = coordinate originali)
+    """
+    # Leaflet vuole EPSG:4326
+    gdf_ll = gdf.to_crs(epsg=4326)
+    # Accesso posizionale (niente .loc per riga); coordinate arrotondate per alleggerire il file
+    table = _annual_metrics_frame(results)
+    index = gdf_ll.index.to_numpy()
+    valid_pos = np.flatnonzero(gdf_ll.index.isin(table.index))
+    geoms = gdf_ll.geometry.to_numpy()[valid_pos]
+    if coord_precision is not None:
+        # pointwise: arrotonda i vertici senza ricostruire la topologia (più veloce, ordine invariato)
+        geoms = shapely.set_precision(geoms, 10.0 ** -coord_precision, mode='pointwise')
+    # Geometrie serializzate in blocco da GEOS (una sola chiamata C), poi incollate nelle feature
+    geom_json = ['null' if g is None else g for g in shapely.to_geojson(geoms)]
+    
+    # Proprietà preparate fuori dal loop di scrittura
+    valid_idx = index[valid_pos].tolist()
+    rows = table.reindex(valid_idx)
+    energies = rows['energy_kwh'].tolist() if valid_idx else []
+    cfs = rows['capacity_factor'].to_numpy(dtype=float) if valid_idx else np.empty(0)
+    energies_r = [round(e, 2) for e in energies]
+    cfs_r = [round(c, 4) for c in cfs.tolist()]
+    popups = [
+        f"Building {idx}: {e:.0f} kWh/year, CF {c*100:.1f}%"
+        for idx, e, c in zip(valid_idx, energies, cfs.tolist())
+    ]
+    
+    # Classificazione CF vettoriale (stesse soglie della vecchia catena if/elif)
+    # (CF NaN -> very_low, come faceva la catena if/elif; searchsorted lo metterebbe in fondo)
+    cat_ids = np.where(np.isnan(cfs), 0, np.searchsorted(CF_BINS, cfs, side='right')).tolist()
+    
+    n_features = len(valid_idx)
+    n_procs = os.cpu_count() or 1
+    use_pool = parallel and n_procs > 1 and n_features >= PARALLEL_EXPORT_MIN_FEATURES
+    n_chunks = n_procs * 4 if use_pool else 1
+    bounds = np.linspace(0, n_features, n_chunks + 1).astype(int)
+    chunk_args = [
+        (valid_idx[a:b], geom_json[a:b], energies_r[a:b], cfs_r[a:b],
+         cat_ids[a:b], popups[a:b], pretty)
+        for a, b in zip(bounds[:-1], bounds[1:])
+    ]
+    
+    with open(output_path, "wb") as f:
+        if not ndjson:
+            f.write(b'{"type":"FeatureCollection","features":[\n')
+        
+        def _write_chunks(chunks):
+            first = True
+            for chunk in chunks:
+                for feature in chunk:
+                    if ndjson:
+                        f.write(feature)
+                        f.write(b'\n')
+                    else:
+                        if not first:
+                            f.write(b',\n')
+                        f.write(feature)
+                    first = False
+        
+        if use_pool:
+            # spawn: niente fork di un processo con GDAL/GEOS già inizializzati
+            with mp.get_context('spawn').Pool(n_procs) as pool:
+                _write_chunks(pool.imap(_build_feature_chunk, chunk_args))
+        else:
+            _write_chunks(map(_build_feature_chunk, chunk_args))
+        
+        if not ndjson:
+            f.write(b'\n]}\n')
         
     print(f"\nGeoJSON exported: {output_path}")
 
 
 
+# ============================================================
+# SALVATAGGIO RISULTATI (PARQUET)
+# ============================================================
+
+# Sezioni annidate salvate come testo JSON (profili orari, scenari on-demand)
+_NESTED_RESULT_KEYS = ('best_worst_days', 'tilt_sensitivity', 'horizon_impact')
+
+
+def results_to_dataframe(results: dict) -> pd.DataFrame:
+    """
+    Appiattisce il dict dei risultati in una tabella (una riga per edificio).
+    annual_metrics e building_props diventano colonne tipizzate.
+    
+    Args:
+        results: dict {idx: result} da process_all_buildings (None = fallito)
+    
+    Returns:
+        DataFrame indicizzato per building_idx
+    """
+    rows = []
+    for idx, r in results.items():
+        if r is None:
+            continue
+        props = r['building_props']
+        endpoints = props.get('long_side_endpoints') or [(np.nan, np.nan), (np.nan, np.nan)]
+        midpoint = props.get('long_side_midpoint') or (np.nan, np.nan)
+        row = {
+            'building_idx': int(idx),
+            'lat': r['location']['lat'],
+            'lon': r['location']['lon'],
+            'centroid_x': r['location']['centroid_xy'][0],
+            'centroid_y': r['location']['centroid_xy'][1],
+            'crs': r['location']['crs'],
+            'area_m2': props['area_m2'],
+            'height_m': props['height_m'],
+            'aspect_deg': props['aspect_deg'],
+            'azimuth_deg': props['azimuth_deg'],
+            'peakpower_kwp': props['peakpower_kwp'],
+            'uncertain_orientation': props['uncertain_orientation'],
+            'long_side_p1_x': endpoints[0][0],
+            'long_side_p1_y': endpoints[0][1],
+            'long_side_p2_x': endpoints[1][0],
+            'long_side_p2_y': endpoints[1][1],
+            'long_side_mid_x': midpoint[0],
+            'long_side_mid_y': midpoint[1],
+            'userhorizon_str': r['userhorizon_str'],
+        }
+        row.update(r['annual_metrics'])
+        for key in _NESTED_RESULT_KEYS:
+            row[key] = json.dumps(r.get(key))
+        rows.append(row)
+    return pd.DataFrame(rows).set_index('building_idx') if rows else pd.DataFrame()
+
+
+def results_from_dataframe(df: pd.DataFrame) -> dict:
+    """
+    Ricostruisce il dict {idx: result} da results_to_dataframe.
+    
+    Args:
+        df: DataFrame indicizzato per building_idx
+    
+    Returns:
+        dict compatibile con plot_viewer / export_geojson_for_leaflet
+    """
+    metric_cols = [c for c in (
+        'energy_kwh', 'capacity_factor', 'specific_yield_kwh_kw', 'avg_power_w',
+        'max_power_w', 'min_power_w', 'peak_hours_h', 'num_hours'
+    ) if c in df.columns]
+    results = {}
+    for idx, row in zip(df.index.tolist(), df.to_dict('records')):
+        if np.isnan(row['long_side_p1_x']):
+            endpoints = None
+        else:
+            endpoints = [(row['long_side_p1_x'], row['long_side_p1_y']),
+                         (row['long_side_p2_x'], row['long_side_p2_y'])]
+        midpoint = None if np.isnan(row['long_side_mid_x']) else (row['long_side_mid_x'], row['long_side_mid_y'])
+        result = {
+            'location': {
+                'lat': row['lat'],
+                'lon': row['lon'],
+                'centroid_xy': (row['centroid_x'], row['centroid_y']),
+                'crs': row['crs']
+            },
+            'building_props': {
+                'area_m2': row['area_m2'],
+                'height_m': row['height_m'],
+                'aspect_deg': row['aspect_deg'],
+                'azimuth_deg': row['azimuth_deg'],
+                'peakpower_kwp': row['peakpower_kwp'],
+                'uncertain_orientation': bool(row['uncertain_orientation']),
+                'long_side_endpoints': endpoints,
+                'long_side_midpoint': midpoint
+            },
+            'annual_metrics': {c: row[c] for c in metric_cols},
+            'userhorizon_str': row['userhorizon_str'],
+        }
+        for key in _NESTED_RESULT_KEYS:
+            result[key] = json.loads(row[key]) if key in row else None
+        results[int(idx)] = result
+    return results
+
+
+def save_results_parquet(results, path: str = 'pv_results.parquet') -> None:
+    """
+    Salva i risultati su parquet (colonnare, tipizzato, compresso).
+    results: dict {idx: result} o DataFrame già prodotto da results_to_dataframe.
+    """
+    df = results if isinstance(results, pd.DataFrame) else results_to_dataframe(results)
+    df.to_parquet(path)
+    print(f"\nResults saved: {path}")
+
+
+def load_results_parquet(path: str) -> dict:
+    """Carica i risultati salvati con save_results_parquet."""
+    return results_from_dataframe(pd.read_parquet(path))
+
+
 # ============================================================
 # UTILITÀ: CARICA RISULTATI DA FILE
 # ============================================================
 
+def save_pvgis_outputs(summary: dict, df_hourly: pd.DataFrame, dir_path: str) -> tuple:
+    """
+    Salva output PVGIS: summary in JSON, serie oraria in parquet (zstd).
+    Stessi nomi file di pvgis_horizon_from_shapefile, con .parquet al posto di .csv.
+    
+    Args:
+        summary: dict riepilogo
+        df_hourly: DataFrame serie oraria
+        dir_path: cartella di output
+    
+    Returns:
+        (summary_json_path, hourly_parquet_path)
+    """
+    out_dir = Path(dir_path)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    summary_path = out_dir / 'output_summary.json'
+    hourly_path = out_dir / 'output_hourly_data.parquet'
+    
+    with open(summary_path, 'w') as f:
+        json.dump(summary, f, indent=2, default=float)
+    df_hourly.to_parquet(hourly_path, compression='zstd', engine='pyarrow', index=False)
+    
+    return str(summary_path), str(hourly_path)
+
+
 def load_pvgis_outputs(summary_json_path: str, hourly_csv_path: str) -> tuple:
     """
     Carica output PVGIS da file (legacy, per compatibilità).
+    Se accanto al CSV esiste la versione .parquet (save_pvgis_outputs) usa quella.
     
     Args:
         summary_json_path: Path a output_summary.json
-        hourly_csv_path: Path a output_hourly_data.csv
+        hourly_csv_path: Path a output_hourly_data.csv (o .parquet)
     
     Returns:
         (summary_dict, df_hourly)
@@ -662,7 +1299,13 @@ def load_pvgis_outputs(summary_json_path: str, hourly_csv_path: str) -> tuple:
     with open(summary_json_path, 'r') as f:
         summary = json.load(f)
     
-    df_hourly = pd.read_csv(hourly_csv_path)
+    parquet_path = Path(hourly_csv_path).with_suffix('.parquet')
+    if parquet_path.exists():
+        df_hourly = pd.read_parquet(parquet_path)
+    elif _ARROW_READ:
+        df_hourly = pd.read_csv(hourly_csv_path, engine='pyarrow', dtype=HOURLY_DTYPES)
+    else:
+        df_hourly = pd.read_csv(hourly_csv_path, dtype=HOURLY_DTYPES)
     
     return summary, df_hourly
 
@@ -675,55 +1318,79 @@ if __name__ == '__main__':
     import sys
     
     if len(sys.argv) < 2:
-        print('Usage: python pvgis_analyzer.py path/to/buildings.zip [--horizon-impact]')
+        print('Usage: python pvgis_analyzer.py path/to/buildings.zip [--horizon-impact] [--concurrency N]')
         sys.exit(1)
     
     zip_path = sys.argv[1]
     compute_horizon_impact_all = '--horizon-impact' in sys.argv
+    max_workers = MAX_WORKERS
+    if '--concurrency' in sys.argv:
+        max_workers = max(1, int(sys.argv[sys.argv.index('--concurrency') + 1]))
     
-    # Extract e load
-    tmpdir = tempfile.mkdtemp(prefix='pv_analysis_')
+    # Load: lettura diretta dallo zip (GDAL /vsizip/), estrazione solo come fallback
+    tmpdir = None
     try:
-        shp_paths = extract_zip_find_shp(zip_path, tmpdir)
-        shp = pick_building_shp(shp_paths)
+        try:
+            shp = pick_building_shp(list_zip_shp(zip_path))
+            gdf = read_buildings(shp)
+        except Exception as e:
+            print(f"Could not read shapefile from ZIP directly ({e}), extracting...")
+            # tmpfs se disponibile: l'estrazione resta in RAM
+            tmpdir = tempfile.mkdtemp(
+                prefix='pv_analysis_',
+                dir='/dev/shm' if os.path.isdir('/dev/shm') else None
+            )
+            shp = pick_building_shp(extract_zip_find_shp(zip_path, tmpdir))
+            gdf = read_buildings(shp)
         print(f"Using shapefile: {shp}")
         
-        gdf = gpd.read_file(shp)
         if gdf.crs is None:
             gdf = gdf.set_crs(epsg=4326)
         
-        # Reproject to UTM
-        gdf_ll = gdf.to_crs(epsg=4326)
-        rep_point = gdf_ll.union_all().centroid
-        lon, lat = rep_point.x, rep_point.y
-        utm_epsg = lonlat_to_utm_epsg(lon, lat)
+        # Reproject to UTM (zona dal punto medio dei bounds, niente union)
+        utm_epsg = estimate_utm_epsg(gdf)
         gdf = gdf.to_crs(epsg=utm_epsg)
         
         # Process all buildings
         print(f"\nProcessing {len(gdf)} buildings...\n")
-        results = process_all_buildings(gdf, compute_horizon_impact_all=compute_horizon_impact_all)
+        results = process_all_buildings(
+            gdf,
+            compute_horizon_impact_all=compute_horizon_impact_all,
+            max_workers=max_workers
+        )
 
         # AGGIUNGI QUESTE 2 RIGHE:
         from plot_viewer import plot_pv_potential
         plot_pv_potential(gdf, results, 'pv_potential_map.png')
         
+        # Tabella colonnare (una riga per edificio), condivisa da export, salvataggio e summary
+        table = results_to_dataframe(results)
+        
         # Export GeoJSON
-        export_geojson_for_leaflet(gdf, results)
+        export_geojson_for_leaflet(gdf, table)
+        
+        # Salva risultati (riutilizzabili da plot_viewer.py)
+        save_results_parquet(table)
         
         # Summary
         print("\n" + "="*60)
         print("SUMMARY")
         print("="*60)
-        valid_results = [r for r in results.values() if r is not None]
-        print(f"Successfully processed: {len(valid_results)}/{len(gdf)} buildings")
+        print(f"Successfully processed: {len(table)}/{len(gdf)} buildings")
         
-        for idx, result in results.items():
-            if result:
-                metrics = result['annual_metrics']
-                print(f"  Building {idx}: {metrics['energy_kwh']} kWh, CF {metrics['capacity_factor']*100:.1f}%")
+        # Una sola scrittura su stdout invece di un print per edificio
+        if len(table):
+            lines = [
+                f"  Building {idx}: {energy} kWh, CF {cf*100:.1f}%"
+                for idx, energy, cf in zip(table.index.tolist(),
+                                           table['energy_kwh'].tolist(),
+                                           table['capacity_factor'].tolist())
+            ]
+            sys.stdout.write("\n".join(lines) + "\n")
     
     finally:
-        shutil.rmtree(tmpdir)
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir)
 
 
 def analyze_first_building(shp_path: str) -> dict:
@@ -735,17 +1402,14 @@ def analyze_first_building(shp_path: str) -> dict:
         dict con annual_metrics e best_worst_days
     """
     import geopandas as gpd
-    gdf = gpd.read_file(shp_path)
+    gdf = read_buildings(shp_path)
     if gdf.crs is None:
         gdf = gdf.set_crs(epsg=4326)
-    # Reproject to UTM
-    gdf_ll = gdf.to_crs(epsg=4326)
-    rep_point = gdf_ll.union_all().centroid
-    lon, lat = rep_point.x, rep_point.y
-    utm_epsg = lonlat_to_utm_epsg(lon, lat)
+    # Reproject to UTM (zona dal punto medio dei bounds, niente union)
+    utm_epsg = estimate_utm_epsg(gdf)
     gdf = gdf.to_crs(epsg=utm_epsg)
     # Analizza solo il primo edificio
-    result = process_building(gdf, 0)
+    result = process_building(gdf, 0, utm_epsg=utm_epsg)
     if result:
         return {
             "annual_metrics": result["annual_metrics"],
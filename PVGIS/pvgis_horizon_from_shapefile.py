@@ -20,21 +20,50 @@ Uso da altri moduli:
 
 import sys
 import os
+import atexit
 import zipfile
 import tempfile
 import math
 import json
+import time
+import hashlib
+import sqlite3
+import threading
+import zlib
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import shutil
 import pandas as pd
 
 import geopandas as gpd
 import numpy as np
+import shapely
 import matplotlib.pyplot as plt
 from matplotlib.lines import Line2D
+from matplotlib.collections import LineCollection
 import requests
-from shapely.geometry import Point, LineString, Polygon
-from shapely.ops import nearest_points
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from pyproj import Transformer
+from shapely.geometry import Point, Polygon
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# pyogrio (+ pyarrow) opzionali: lettura colonnare dello shapefile invece del percorso per-feature
+try:
+    import pyogrio
+    import pyarrow  # noqa: F401
+except ImportError:
+    pyogrio = None
+
+# orjson opzionale: parsing delle risposte PVGIS (8760 record orari) molto più veloce di json stdlib
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # ----------------------
 # Configurazioni
@@ -44,7 +73,20 @@ RAY_LENGTH_M = 200
 DEFAULT_HEIGHT_M = 10.0
 ASSUME_LEVEL_HEIGHT = 3.0
 PVGIS_ENDPOINT = "https://re.jrc.ec.europa.eu/api/v5_2/seriescalc" 
+PVGIS_MAX_RETRIES = 4
+PVGIS_BACKOFF_S = 1.0
+PVGIS_RETRY_STATUS = (429, 502, 503, 504)
+PVGIS_POOL_SIZE = 16
+PVGIS_MAX_CONCURRENCY = 8
+PVGIS_CONNECT_RETRIES = 3
+# Cache risposte PVGIS: cartella da $PVGIS_CACHE_DIR o set_pvgis_cache_dir(),
+# altrimenti PVGIS/.cache (indipendente dalla cartella di lavoro)
+PVGIS_CACHE_DIR = Path(os.environ.get("PVGIS_CACHE_DIR") or Path(__file__).resolve().parent / ".cache")
+PVGIS_CACHE_FILENAME = "pvgis_responses.sqlite"
+PVGIS_CACHE_TTL_S = 90 * 24 * 3600  # risposte più vecchie vengono richieste di nuovo
+PVGIS_CACHE_LATLON_DECIMALS = 3
 PLOT_OUTPUT = "output_plot.png"
+PLOT_DPI = 150
 SUMMARY_OUTPUT = "output_summary.json"
 HOURLY_OUTPUT = "output_hourly_data.csv"
 DEFAULT_TILT_FOR_ASPECT = 35
@@ -55,6 +97,20 @@ POWER_DENSITY_W_PER_M2 = 200
 
 TARGET_BUILDING_INDEX = 0
 
+# Direzioni dei raggi per la griglia standard STEP_DEG (N=0, E=90), calcolate una volta sola
+_ANGLES = np.arange(0, 360, STEP_DEG)
+_SIN = np.sin(np.radians(_ANGLES))
+_COS = np.cos(np.radians(_ANGLES))
+
+
+def _ray_directions(step_deg):
+    """Angoli e componenti (sin, cos) dei raggi; tabella precalcolata per step_deg == STEP_DEG."""
+    if step_deg == STEP_DEG:
+        return _ANGLES, _SIN, _COS
+    angles = np.arange(0, 360, step_deg)
+    rad = np.radians(angles)
+    return angles, np.sin(rad), np.cos(rad)
+
 
 # ----------------------
 # Utility (INVARIATE)
@@ -70,6 +126,16 @@ def extract_zip_find_shp(zip_path: str, out_dir: str):
     return shp_list
 
 
+def list_zip_shp(zip_path: str):
+    """
+    Ritorna i .shp dentro lo zip come percorsi GDAL /vsizip/ (lettura senza estrarre).
+    """
+    zip_abs = Path(zip_path).resolve().as_posix()
+    with zipfile.ZipFile(zip_path, 'r') as zf:
+        names = [n for n in zf.namelist() if n.lower().endswith('.shp')]
+    return [f"/vsizip/{zip_abs}/{n}" for n in names]
+
+
 def pick_building_shp(shp_paths):
     """Sceglie il file shp che probabilmente contiene edifici (heuristic)."""
     if not shp_paths:
@@ -80,6 +146,18 @@ def pick_building_shp(shp_paths):
     return shp_paths[0]
 
 
+def read_building_layer(shp_path: str):
+    """
+    Legge il layer edifici per il calcolo dell'horizon: con pyogrio solo geometria e
+    attributi di altezza (HEIGHT_ATTR_KEYS) in blocco via Arrow, altrimenti gpd.read_file.
+    """
+    if pyogrio is None:
+        return gpd.read_file(shp_path)
+    fields = set(pyogrio.read_info(shp_path)['fields'])
+    columns = [k for k in HEIGHT_ATTR_KEYS if k in fields]
+    return gpd.read_file(shp_path, engine='pyogrio', columns=columns, use_arrow=True)
+
+
 def lonlat_to_utm_epsg(lon, lat):
     """Calcola EPSG UTM per la posizione (nord emisfero)."""
     zone = int((lon + 180) / 6) + 1
@@ -89,44 +167,94 @@ def lonlat_to_utm_epsg(lon, lat):
 
 def wrap_to_minus180_180(deg):
     """Wraps an angle in degrees to the range (-180, 180]."""
+    if np.ndim(deg):
+        return wrap_to_minus180_180_arr(deg)
     deg = (deg + 180) % 360 - 180
     return deg
 
 
 def pvgis_aspect_from_azimuth(azimuth):
     """Converts 0-360 azimuth (N=0, E=90) to PVGIS aspect (-180..180, S=0)."""
+    if np.ndim(azimuth):
+        return pvgis_aspect_from_azimuth_arr(azimuth)
     return wrap_to_minus180_180(azimuth - 180)
 
 
+def wrap_to_minus180_180_arr(deg):
+    """wrap_to_minus180_180 su un intero array (ufunc numpy, stesso risultato di % in Python)."""
+    return np.mod(np.asarray(deg, dtype=float) + 180, 360) - 180
+
+
+def pvgis_aspect_from_azimuth_arr(azimuth):
+    """pvgis_aspect_from_azimuth su un intero array di azimuth."""
+    return wrap_to_minus180_180_arr(np.asarray(azimuth, dtype=float) - 180)
+
+
 # ----------------------
 # Core (INVARIATE)
 # ----------------------
 
+HEIGHT_ATTR_KEYS = ['Height', 'building:height', 'bldg:height', 'roof:height', 'levels', 'building:levels', 'floors']
+
+
+def _parse_height_value(val):
+    """Valore attributo -> float (stringhe: primo token, es. '12 m'); None se assente/non numerico."""
+    if val in (None, '', 'nan'):
+        return None
+    try:
+        if isinstance(val, str):
+            val = val.split(' ')[0]
+        return float(val)
+    except Exception:
+        return None
+
+
 def estimate_height_attr(feat):
     """Tenta estrarre l'altezza da varie proprietà comuni."""
-    if isinstance(feat, dict):
-        props = feat
-    else:
-        props = feat
-    
-    keys_try = ['Height', 'building:height', 'bldg:height', 'roof:height', 'levels', 'building:levels', 'floors']
-    for k in keys_try:
-        if k in props and props.get(k) not in (None, '', 'nan'):
-            try:
-                val = props.get(k)
-                if isinstance(val, str):
-                    val = val.split(' ')[0]
-                val = float(val)
-                if val <= 0:
-                    continue
-                if 'level' in k or 'floor' in k:
-                    return val * ASSUME_LEVEL_HEIGHT
-                return val
-            except Exception:
+    props = feat
+    for k in HEIGHT_ATTR_KEYS:
+        if k in props:
+            val = _parse_height_value(props.get(k))
+            if val is None or val <= 0:
                 continue
+            if 'level' in k or 'floor' in k:
+                return val * ASSUME_LEVEL_HEIGHT
+            return val
     return DEFAULT_HEIGHT_M
 
 
+def estimate_heights(gdf):
+    """
+    Versione vettoriale di estimate_height_attr su tutto il GeoDataFrame
+    (stesse chiavi e stessa precedenza, una colonna alla volta invece di apply per riga).
+    
+    Returns:
+        np.ndarray (N,) altezze in metri
+    """
+    n = len(gdf)
+    heights = np.full(n, DEFAULT_HEIGHT_M, dtype=float)
+    resolved = np.zeros(n, dtype=bool)
+    for k in HEIGHT_ATTR_KEYS:
+        if k not in gdf.columns:
+            continue
+        col = gdf[k]
+        if pd.api.types.is_numeric_dtype(col):
+            # NaN numerico passa il filtro, esattamente come nel caso scalare
+            vals = col.to_numpy(dtype=float, na_value=np.nan)
+            parsed = np.ones(n, dtype=bool)
+        else:
+            parsed_vals = [_parse_height_value(v) for v in col.to_numpy(dtype=object)]
+            parsed = np.fromiter((v is not None for v in parsed_vals), dtype=bool, count=n)
+            vals = np.array([np.nan if v is None else v for v in parsed_vals], dtype=float)
+        take = ~resolved & parsed & ~(vals <= 0)
+        mult = ASSUME_LEVEL_HEIGHT if ('level' in k or 'floor' in k) else 1.0
+        heights[take] = vals[take] * mult
+        resolved |= take
+        if resolved.all():
+            break
+    return heights
+
+
 def estimate_peak_power(geometry):
     """Stima la potenza di picco (kWp) in base all'area della geometria."""
     if geometry is None or geometry.is_empty:
@@ -143,79 +271,211 @@ def estimate_peak_power(geometry):
     return round(peakpower_kwp, 2), round(area_m2, 2)
 
 
-def compute_userhorizon_from_gdf(gdf, target_idx, step_deg=10, ray_length=2000):
-    """Calcola la lista di angoli (in gradi) per PVGIS."""
-    target = gdf.iloc[target_idx]
-    target_geom = target.geometry
-    if not target_geom:
-        raise ValueError("Target geometry is empty")
-
-    centroid = target_geom.centroid
-    target_height = estimate_height_attr(target)
-
-    gdf = gdf.copy()
-    gdf['__est_h'] = gdf.apply(estimate_height_attr, axis=1)
-
-    horizon = []
-    angles = np.arange(0, 360, step_deg)
-
-    for angle in angles:
-        dx = ray_length * math.sin(math.radians(angle))
-        dy = ray_length * math.cos(math.radians(angle))
-        ray = LineString([centroid, Point(centroid.x + dx, centroid.y + dy)])
-        max_angle = 0.0
-        first_intersection_point = None
-        first_intersection_height = None
-
-        for idx, row in gdf.iterrows():
-            if idx == target_idx:
-                continue
-            geom = row.geometry
-            if geom is None or geom.is_empty:
-                continue
-            
-            if not ray.intersects(geom):
-                continue
-                
-            inter = ray.intersection(geom)
-            if inter.is_empty:
-                continue
-                
-            try:
-                if inter.geom_type == 'GeometryCollection':
-                    parts = [p for p in inter.geoms if not p.is_empty]
-                    if not parts:
-                        continue
-                    inter = parts[0]
-                
-                np_pair = nearest_points(centroid, inter)
-                inter_pt = np_pair[1]
-                
-            except Exception as e:
-                inter_pt = geom.representative_point()
+def estimate_peak_power_batch(geometries):
+    """
+    Versione vettoriale di estimate_peak_power: aree delle parti calcolate in blocco
+    da GEOS, massimo per edificio con np.maximum.reduceat.
+    
+    Returns:
+        (peakpower_kwp, area_m2): due np.ndarray (N,), arrotondati come estimate_peak_power
+    """
+    geoms = np.asarray(geometries, dtype=object)
+    area_m2 = np.zeros(len(geoms))
+    valid = ~shapely.is_missing(geoms) & ~shapely.is_empty(geoms)
+    area_m2[valid] = shapely.area(geoms[valid])
+
+    # MultiPolygon: area della parte più grande
+    multi = np.flatnonzero(valid & (shapely.get_type_id(geoms) == 6))
+    if multi.size:
+        parts, part_idx = shapely.get_parts(geoms[multi], return_index=True)
+        starts = np.r_[0, np.flatnonzero(np.diff(part_idx)) + 1]
+        area_m2[multi[part_idx[starts]]] = np.maximum.reduceat(shapely.area(parts), starts)
+
+    peakpower_kwp = area_m2 * ROOF_AREA_FACTOR * POWER_DENSITY_W_PER_M2 / 1000.0
+    return (np.array([round(v, 2) for v in peakpower_kwp.tolist()]),
+            np.array([round(v, 2) for v in area_m2.tolist()]))
+
+
+def prepare_horizon_context(gdf):
+    """
+    Dati per-distretto usati da compute_userhorizon_from_gdf, calcolati una volta sola:
+    geometrie, STRtree, altezze e centroidi di tutti gli edifici.
+    Da passare come context= quando si calcola l'horizon di molti edifici dello stesso gdf
+    (senza, ogni chiamata ricalcola tutto: O(N²) sul distretto).
+    
+    Geometrie vuote o mancanti restano fuori da STRtree e buffer dei lati e hanno
+    centroide NaN: l'errore scatta solo se sono il target (compute_userhorizon_from_gdf).
+    
+    Returns:
+        dict con 'geoms', 'tree', 'heights', 'centroids_xy'
+    """
+    geoms = np.asarray(gdf.geometry.values, dtype=object)
+    valid = ~shapely.is_missing(geoms) & ~shapely.is_empty(geoms)
+    geoms = np.where(valid, geoms, None)
+    centroids_xy = np.full((len(geoms), 2), np.nan)
+    centroids_xy[valid] = shapely.get_coordinates(shapely.centroid(geoms[valid]))
+    if _ray_hit_kernel is None:
+        # Percorso shapely: edifici "prepared" (indice dei lati in GEOS) per gli intersects ripetuti
+        shapely.prepare(geoms)
+    return {
+        'geoms': geoms,
+        'tree': shapely.STRtree(geoms),
+        'heights': estimate_heights(gdf),
+        'centroids_xy': centroids_xy,
+    }
 
-            dist = centroid.distance(inter_pt)
-            if dist <= 1e-6:
-                continue
 
-            h_b = row['__est_h']
-            
-            h_diff = h_b - target_height
-            if h_diff <= 0:
-                continue
+def _building_segments(geoms):
+    """
+    Lati di tutti i poligoni (esterni, fori, parti di MultiPolygon) in un buffer piatto
+    per il kernel Numba: segs (M, 4) = x0, y0, x1, y1 ordinati per edificio,
+    offs (N+1,) con i lati dell'edificio i in segs[offs[i]:offs[i+1]].
+    """
+    parts, part_bldg = shapely.get_parts(geoms, return_index=True)
+    rings, ring_part = shapely.get_rings(parts, return_index=True)
+    coords, coord_ring = shapely.get_coordinates(rings, return_index=True)
+    same = coord_ring[1:] == coord_ring[:-1]
+    segs = np.ascontiguousarray(np.hstack([coords[:-1][same], coords[1:][same]]))
+    seg_bldg = part_bldg[ring_part[coord_ring[:-1][same]]]
+    offs = np.searchsorted(seg_bldg, np.arange(len(geoms) + 1)).astype(np.int64)
+    return segs, offs
+
+
+if njit is not None:
+    # nogil e non parallel: il kernel viene chiamato in contemporanea dai thread di
+    # process_all_buildings (il layer workqueue di Numba non regge lanci paralleli concorrenti)
+    @njit(nogil=True, cache=True)
+    def _ray_hit_kernel(ox, oy, dir_x, dir_y, ray_length, pair_ray, pair_bldg, segs, offs):
+        """
+        Distanza dal centroide al primo punto di ogni coppia (raggio, edificio):
+        minimo parametro t delle intersezioni raggio/lato, 0 se il centroide è dentro l'edificio.
+        """
+        n = pair_ray.shape[0]
+        dist = np.full(n, np.inf)
+        for k in range(n):
+            dx = dir_x[pair_ray[k]]
+            dy = dir_y[pair_ray[k]]
+            best = np.inf
+            inside = False
+            for s in range(offs[pair_bldg[k]], offs[pair_bldg[k] + 1]):
+                px = segs[s, 0] - ox
+                py = segs[s, 1] - oy
+                ex = segs[s, 2] - segs[s, 0]
+                ey = segs[s, 3] - segs[s, 1]
+                # Punto nel poligono (pari/dispari su tutti gli anelli)
+                if (py > 0.0) != (py + ey > 0.0):
+                    if px - py * ex / ey > 0.0:
+                        inside = not inside
+                denom = dx * ey - dy * ex
+                if denom != 0.0:
+                    t = (px * ey - py * ex) / denom
+                    u = (px * dy - py * dx) / denom
+                    if 0.0 <= t <= ray_length and 0.0 <= u <= 1.0 and t < best:
+                        best = t
+                elif px * dy - py * dx == 0.0:
+                    # Lato collineare al raggio: estremo più vicino dentro il raggio
+                    t0 = px * dx + py * dy
+                    t1 = (px + ex) * dx + (py + ey) * dy
+                    lo = min(t0, t1)
+                    hi = max(t0, t1)
+                    if hi >= 0.0 and lo <= ray_length:
+                        t = max(lo, 0.0)
+                        if t < best:
+                            best = t
+            dist[k] = 0.0 if inside else best
+        return dist
+else:
+    _ray_hit_kernel = None
+
+
+def compute_userhorizon_from_gdf(gdf, target_idx, step_deg=10, ray_length=2000, context=None):
+    """
+    Calcola la lista di angoli (in gradi) per PVGIS.
+    context: opzionale, da prepare_horizon_context(gdf) (riusato fra edifici).
+    Con Numba installato l'intersezione raggio/edificio usa _ray_hit_kernel,
+    altrimenti shapely (intersection + shortest_line).
+    """
+    if context is None:
+        context = prepare_horizon_context(gdf)
+    geoms, tree, heights = context['geoms'], context['tree'], context['heights']
+
+    # Target direttamente dagli array del contesto (niente Series di riga con gdf.iloc)
+    target_geom = geoms[target_idx]
+    if target_geom is None or target_geom.is_empty:
+        raise ValueError("Target geometry is empty")
 
-            elev_angle = math.degrees(math.atan(h_diff / dist))
-            
-            if elev_angle > max_angle:
-                max_angle = elev_angle
-                first_intersection_point = inter_pt
-                first_intersection_height = h_b
+    centroid = Point(context['centroids_xy'][target_idx])
+    target_height = float(heights[target_idx])
+
+    # Raggi come array shapely (un'unica costruzione in C)
+    angles, sin_a, cos_a = _ray_directions(step_deg)
+    ray_coords = np.empty((len(angles), 2, 2))
+    ray_coords[:, 0, 0] = centroid.x
+    ray_coords[:, 0, 1] = centroid.y
+    ray_coords[:, 1, 0] = centroid.x + ray_length * sin_a
+    ray_coords[:, 1, 1] = centroid.y + ray_length * cos_a
+    rays = shapely.linestrings(ray_coords)
+
+    # Coppie (raggio, edificio) candidate: STRtree scarta già tutto ciò che è fuori dal bbox del raggio.
+    # Con il kernel Numba basta il test sui bbox (le coppie senza impatto tornano dist=inf),
+    # altrimenti intersects esatto valutato sugli edifici prepared (non sui raggi, 2 soli vertici)
+    ray_i, bldg_i = tree.query(rays)
+    if _ray_hit_kernel is None:
+        hit = shapely.intersects(geoms[bldg_i], rays[ray_i])
+        ray_i, bldg_i = ray_i[hit], bldg_i[hit]
+    keep = np.asarray(gdf.index[bldg_i] != target_idx)
+    ray_i, bldg_i = ray_i[keep], bldg_i[keep]
+
+    if _ray_hit_kernel is not None:
+        # Kernel Numba: primo punto di impatto lungo il raggio, direttamente sui lati dei poligoni
+        if 'segments' not in context:
+            context['segments'] = _building_segments(geoms)
+        segs, offs = context['segments']
+        dist = _ray_hit_kernel(centroid.x, centroid.y, sin_a, cos_a, float(ray_length),
+                               ray_i.astype(np.int64), bldg_i.astype(np.int64), segs, offs)
+        keep = np.isfinite(dist)
+        ray_i, bldg_i, dist = ray_i[keep], bldg_i[keep], dist[keep]
+        nearest = np.column_stack([centroid.x + dist * sin_a[ray_i],
+                                   centroid.y + dist * cos_a[ray_i]])
+    else:
+        inter = shapely.intersection(rays[ray_i], geoms[bldg_i])
+        keep = ~shapely.is_empty(inter)
+        ray_i, bldg_i, inter = ray_i[keep], bldg_i[keep], inter[keep]
+
+        # GeometryCollection: come prima, si tiene la prima parte non vuota
+        for k in np.flatnonzero(shapely.get_type_id(inter) == 7):
+            parts = [p for p in inter[k].geoms if not p.is_empty]
+            inter[k] = parts[0]
+
+        # Punto dell'intersezione più vicino al centroide: l'intersezione giace sul raggio,
+        # quindi è il vertice con parametro t = (p - c)·(sinθ, cosθ) minimo (niente nearest_points)
+        pts, owner = shapely.get_coordinates(inter, return_index=True)
+        t = (pts[:, 0] - centroid.x) * sin_a[ray_i[owner]] + (pts[:, 1] - centroid.y) * cos_a[ray_i[owner]]
+        order = np.lexsort((t, owner))
+        nearest = pts[order[np.r_[True, owner[order][1:] != owner[order][:-1]]]] if order.size else pts
+        dist = np.hypot(nearest[:, 0] - centroid.x, nearest[:, 1] - centroid.y)
+    h_b = heights[bldg_i]
+    h_diff = h_b - target_height
+    ok = (dist > 1e-6) & (h_diff > 0)
+    ray_i, nearest, h_b = ray_i[ok], nearest[ok], h_b[ok]
+    elev = np.degrees(np.arctan(h_diff[ok] / dist[ok]))
+
+    # Massimo per raggio; a parità vince il primo edificio in ordine di gdf (come il loop originale)
+    order = np.lexsort((bldg_i[ok], -elev, ray_i))
+    ray_sorted = ray_i[order]
+    first = order[np.r_[True, ray_sorted[1:] != ray_sorted[:-1]]] if order.size else order
+    best = {int(ray_i[j]): j for j in first}
+    # Punti di impatto creati in blocco (un'unica chiamata in C)
+    hit_pts = dict(zip(first.tolist(), shapely.points(nearest[first])))
 
-        if max_angle < 0:
-            max_angle = 0.0
-            
-        horizon.append({'angle': int(angle), 'deg': round(max_angle, 2),
-                        'pt': first_intersection_point, 'h': first_intersection_height})
+    horizon = []
+    for r, angle in enumerate(angles):
+        j = best.get(r)
+        if j is None:
+            horizon.append({'angle': int(angle), 'deg': 0.0, 'pt': None, 'h': None})
+        else:
+            horizon.append({'angle': int(angle), 'deg': round(float(elev[j]), 2),
+                            'pt': hit_pts[j], 'h': float(h_b[j])})
 
     horizon_degrees = [item['deg'] for item in horizon]
     return horizon, horizon_degrees, centroid, target_height
@@ -344,18 +604,198 @@ def compute_panel_orientation(geometry, crs_projected=True):
     return results
 
 
+def compute_panel_orientation_batch(geometries):
+    """
+    Versione vettoriale di compute_panel_orientation su tutti gli edifici:
+    MBR, lati, punti medi e azimuth calcolati come array numpy (N, 4, 2).
+    Le geometrie che la versione scalare scarterebbe (vuote, non poligonali,
+    MBR degenere) passano da compute_panel_orientation, stessi messaggi di errore.
+    
+    Returns:
+        lista di dict, stesse chiavi e stessi valori di compute_panel_orientation
+    """
+    geoms = np.asarray(geometries, dtype=object)
+    n = len(geoms)
+    out = [None] * n
+
+    # MultiPolygon: parte di area massima (la prima a parità, come max())
+    parts, part_idx = shapely.get_parts(geoms, return_index=True)
+    order = np.lexsort((np.arange(len(parts)), -shapely.area(parts), part_idx))
+    first = order[np.r_[True, part_idx[order][1:] != part_idx[order][:-1]]] if order.size else order
+    main = np.full(n, None, dtype=object)
+    main[part_idx[first]] = parts[first]
+
+    type_id = shapely.get_type_id(geoms)
+    ok = np.isin(type_id, (3, 6)) & ~shapely.is_empty(geoms) & (shapely.get_type_id(main) == 3)
+    ok[ok] = ~shapely.is_empty(main[ok])
+    mbrs = np.full(n, None, dtype=object)
+    mbrs[ok] = shapely.minimum_rotated_rectangle(main[ok])
+    ok[ok] = (shapely.get_type_id(mbrs[ok]) == 3) & (shapely.get_num_coordinates(mbrs[ok]) == 5)
+
+    rows = np.flatnonzero(ok)
+    v = shapely.get_coordinates(mbrs[rows]).reshape(-1, 5, 2)[:, :4]
+    a_xy, b_xy = v, np.roll(v, -1, axis=1)
+    # math.dist come nella versione scalare: con lati quasi uguali (quadrati) anche
+    # un ULP di differenza rispetto a np.hypot cambierebbe il lato scelto
+    lengths = np.array(
+        [math.dist(p, q) for p, q in zip(a_xy.reshape(-1, 2).tolist(), b_xy.reshape(-1, 2).tolist())]
+    ).reshape(-1, 4)
+
+    # Lati in ordine di lunghezza decrescente (stabile, come sides.sort)
+    side_order = np.argsort(-lengths, axis=1, kind='stable')
+    r = np.arange(len(rows))
+    long_1, long_2 = side_order[:, 0], side_order[:, 1]
+    long_len = lengths[r, long_1]
+    short_len = lengths[r, side_order[:, 2]]
+
+    mid_1 = (a_xy[r, long_1] + b_xy[r, long_1]) / 2
+    mid_2 = (a_xy[r, long_2] + b_xy[r, long_2]) / 2
+    pick_1 = (mid_1[:, 1] < mid_2[:, 1]) | ((mid_1[:, 1] == mid_2[:, 1]) & (mid_1[:, 0] <= mid_2[:, 0]))
+    chosen = np.where(pick_1, long_1, long_2)
+    c_p1, c_p2 = a_xy[r, chosen], b_xy[r, chosen]
+    mid_c = (c_p1 + c_p2) / 2
+
+    az_side = (np.degrees(np.arctan2(c_p2[:, 0] - c_p1[:, 0], c_p2[:, 1] - c_p1[:, 1])) + 360) % 360
+    cand0 = (az_side + 90) % 360
+    cand1 = (az_side - 90 + 360) % 360
+    pvgis0 = pvgis_aspect_from_azimuth_arr(cand0)
+    pvgis1 = pvgis_aspect_from_azimuth_arr(cand1)
+
+    n_vertices = shapely.get_num_coordinates(shapely.get_exterior_ring(main[rows])) - 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        uncertain = (n_vertices > 4) | (short_len <= 1e-6) | (long_len / short_len < ORIENTATION_UNCERTAINTY_RATIO)
+    mid_pts = shapely.points(np.stack([mid_1, mid_2], axis=1))
+
+    for k, i in enumerate(rows.tolist()):
+        if long_len[k] < 1e-6:
+            continue
+        cands = [round(float(cand0[k]), 2), round(float(cand1[k]), 2)]
+        aspects = [round(float(pvgis0[k]), 2), round(float(pvgis1[k]), 2)]
+        idx = 0 if abs(float(pvgis0[k])) <= abs(float(pvgis1[k])) else 1
+        out[i] = {
+            'panel_azimuth_deg': cands[idx],
+            'pvgis_aspect': aspects[idx],
+            'chosen_long_side_midpoint': (float(mid_c[k, 0]), float(mid_c[k, 1])),
+            'chosen_long_side_endpoints': [(float(c_p1[k, 0]), float(c_p1[k, 1])),
+                                           (float(c_p2[k, 0]), float(c_p2[k, 1]))],
+            'chosen_side_azimuth_deg': round(float(az_side[k]), 2),
+            'candidate_azimuths': cands,
+            'candidate_pvgis_aspects': aspects,
+            'chosen_candidate_index': idx,
+            'long_side_length': round(float(long_len[k]), 2),
+            'short_side_length': round(float(short_len[k]), 2),
+            'num_exterior_vertices': int(n_vertices[k]),
+            'uncertain_orientation_flag': bool(uncertain[k]),
+            'method': 'MBRect_rect_south_midpoint_preference',
+            'error': None,
+            'mbrect_geom': mbrs[i],
+            'long_sides_midpoints': list(mid_pts[k])
+        }
+
+    # Casi di errore: stessa gestione (e messaggi) della versione scalare
+    for i in range(n):
+        if out[i] is None:
+            out[i] = compute_panel_orientation(geoms[i])
+    return out
+
+
 # ----------------------
 # PVGIS call (INVARIATA)
 # ----------------------
 
-def call_pvgis_seriescalc(lat, lon, userhorizon_str, peakpower, tilt=None, aspect=None):
-    """Chiamata API PVGIS v5_2 (seriescalc)."""
+# Sessione HTTP condivisa: keep-alive, niente handshake TCP/TLS per ogni chiamata
+# (pool dimensionato per le chiamate in parallelo da pvgis_analyzer; i retry dell'adapter
+# coprono solo gli errori di connessione, quelli HTTP sono gestiti in call_pvgis_seriescalc)
+_PVGIS_SESSION = requests.Session()
+_PVGIS_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=PVGIS_POOL_SIZE,
+    pool_maxsize=PVGIS_POOL_SIZE,
+    max_retries=Retry(total=PVGIS_CONNECT_RETRIES, read=False)
+))
+atexit.register(_PVGIS_SESSION.close)
+
+
+# Cache su disco delle risposte PVGIS (SQLite, chiave = sha256 dei parametri)
+_PVGIS_CACHE_LOCK = threading.Lock()
+_PVGIS_CACHE_CONN = None
+
+
+def set_pvgis_cache_dir(path):
+    """Sposta la cache PVGIS in `path` (la connessione aperta viene chiusa)."""
+    global PVGIS_CACHE_DIR, _PVGIS_CACHE_CONN
+    with _PVGIS_CACHE_LOCK:
+        if _PVGIS_CACHE_CONN is not None:
+            _PVGIS_CACHE_CONN.close()
+            _PVGIS_CACHE_CONN = None
+        PVGIS_CACHE_DIR = Path(path)
+
+
+def _pvgis_cache_conn():
+    """Apre (una volta sola) il DB cache condiviso fra i thread."""
+    global _PVGIS_CACHE_CONN
+    if _PVGIS_CACHE_CONN is None:
+        PVGIS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        _PVGIS_CACHE_CONN = sqlite3.connect(PVGIS_CACHE_DIR / PVGIS_CACHE_FILENAME, check_same_thread=False)
+        _PVGIS_CACHE_CONN.execute(
+            "CREATE TABLE IF NOT EXISTS responses"
+            " (key TEXT PRIMARY KEY, body BLOB NOT NULL, created_at REAL NOT NULL)"
+        )
+        # pulizia delle risposte scadute, una volta per apertura
+        _PVGIS_CACHE_CONN.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - PVGIS_CACHE_TTL_S,))
+        _PVGIS_CACHE_CONN.commit()
+    return _PVGIS_CACHE_CONN
+
+
+def _pvgis_cache_get(key):
+    with _PVGIS_CACHE_LOCK:
+        row = _pvgis_cache_conn().execute(
+            "SELECT body FROM responses WHERE key = ? AND created_at >= ?",
+            (key, time.time() - PVGIS_CACHE_TTL_S),
+        ).fetchone()
+    if not row:
+        return None
+    body = zlib.decompress(row[0])
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+
+def _pvgis_cache_put(key, body):
+    blob = zlib.compress(body)
+    now = time.time()
+    with _PVGIS_CACHE_LOCK:
+        conn = _pvgis_cache_conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO responses (key, body, created_at) VALUES (?, ?, ?)", (key, blob, now)
+        )
+        conn.commit()
+
+
+def call_pvgis_seriescalc(lat, lon, userhorizon_str, peakpower, tilt=None, aspect=None, use_cache=True,
+                          force_refresh=False):
+    """
+    Chiamata API PVGIS v5_2 (seriescalc).
+    Con use_cache=True lat/lon vengono quantizzati (PVGIS_CACHE_LATLON_DECIMALS, ~100 m,
+    ben sotto la risoluzione dei dati di irraggiamento) e la risposta è riusata da
+    PVGIS_CACHE_DIR se la stessa richiesta è già stata fatta (entro PVGIS_CACHE_TTL_S).
+    Con force_refresh=True la cache non viene letta ma la nuova risposta la sovrascrive.
+    """
     if tilt is None:
         tilt = DEFAULT_TILT_FOR_ASPECT
     
     if aspect is None:
         aspect = 0
 
+    cache_key = None
+    if use_cache:
+        lat = round(float(lat), PVGIS_CACHE_LATLON_DECIMALS)
+        lon = round(float(lon), PVGIS_CACHE_LATLON_DECIMALS)
+        cache_key = hashlib.sha256(json.dumps({
+            'lat': lat, 'lon': lon, 'tilt': float(tilt), 'aspect': float(aspect),
+            'peakpower': float(peakpower), 'horizon': userhorizon_str,
+        }, sort_keys=True).encode('utf-8')).hexdigest()
+        cached = None if force_refresh else _pvgis_cache_get(cache_key)
+        if cached is not None:
+            return cached
+
     params = {
         'lat': lat,
         'lon': lon,
@@ -375,17 +815,45 @@ def call_pvgis_seriescalc(lat, lon, userhorizon_str, peakpower, tilt=None, aspec
         'aspect': aspect
     }
 
-    resp = requests.get(PVGIS_ENDPOINT, params=params, timeout=60)
+    # Retry con backoff esponenziale su rate limit (429) ed errori transitori
+    for attempt in range(PVGIS_MAX_RETRIES + 1):
+        resp = _PVGIS_SESSION.get(PVGIS_ENDPOINT, params=params, timeout=60)
+        if resp.status_code not in PVGIS_RETRY_STATUS or attempt == PVGIS_MAX_RETRIES:
+            break
+        time.sleep(PVGIS_BACKOFF_S * 2 ** attempt)
     resp.raise_for_status()
-    return resp.json()
+    pvgis_json = orjson.loads(resp.content) if orjson is not None else resp.json()
+    if cache_key is not None:
+        _pvgis_cache_put(cache_key, resp.content)
+    return pvgis_json
+
+
+def call_pvgis_seriescalc_many(params_list, max_workers=PVGIS_MAX_CONCURRENCY):
+    """
+    Più chiamate call_pvgis_seriescalc in parallelo sulla sessione condivisa
+    (latenza di rete sovrapposta, connessioni keep-alive riusate dal pool).
+    max_workers limita le richieste contemporanee verso PVGIS (rate limit).
+    
+    Args:
+        params_list: lista di dict con gli argomenti di call_pvgis_seriescalc
+            (lat, lon, userhorizon_str, peakpower, tilt, aspect, use_cache, force_refresh)
+    
+    Returns:
+        lista delle risposte JSON, nello stesso ordine di params_list
+        (la prima chiamata fallita solleva l'eccezione)
+    """
+    if not params_list:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(params_list)))) as pool:
+        return list(pool.map(lambda p: call_pvgis_seriescalc(**p), params_list))
 
 
 # ----------------------
 # Plot (INVARIATA)
 # ----------------------
 
-def plot_scene(gdf, target_idx, centroid, horizon_items, orientation_results, out_png=PLOT_OUTPUT):
-    """Salva un plot della scena."""
+def plot_scene(gdf, target_idx, centroid, horizon_items, orientation_results, out_png=PLOT_OUTPUT, dpi=PLOT_DPI):
+    """Salva un plot della scena (dpi=400 per la qualità di stampa, più lento)."""
     fig, ax = plt.subplots(figsize=(15,15))
     
     base = gdf.plot(ax=ax, color='lightgrey', edgecolor='gray', alpha=0.7)
@@ -396,18 +864,24 @@ def plot_scene(gdf, target_idx, centroid, horizon_items, orientation_results, ou
 
     FONT_SIZE_HORIZON = 12 
     
-    for item in horizon_items:
-        angle = item['angle']
-        dx_r = RAY_LENGTH_M * math.sin(math.radians(angle))
-        dy_r = RAY_LENGTH_M * math.cos(math.radians(angle))
-        x_end = centroid.x + dx_r
-        y_end = centroid.y + dy_r
-        ax.plot([centroid.x, x_end], [centroid.y, y_end], 
-                linestyle='--', color='gray', linewidth=0.8, alpha=0.6)
+    # Raggi in un'unica LineCollection e punti di impatto in un unico scatter
+    angles = np.array([item['angle'] for item in horizon_items])
+    if np.array_equal(angles, _ANGLES):
+        sin_a, cos_a = _SIN, _COS
+    else:
+        sin_a, cos_a = np.sin(np.radians(angles)), np.cos(np.radians(angles))
+    ends = np.column_stack([centroid.x + RAY_LENGTH_M * sin_a,
+                            centroid.y + RAY_LENGTH_M * cos_a])
+    segments = np.stack([np.broadcast_to([centroid.x, centroid.y], ends.shape), ends], axis=1)
+    ax.add_collection(LineCollection(segments, linestyles='--', colors='gray', linewidths=0.8, alpha=0.6))
+
+    hits = [item['pt'] for item in horizon_items if item['pt'] is not None]
+    if hits:
+        ax.scatter([ip.x for ip in hits], [ip.y for ip in hits], marker='x', color='blue', s=40)
 
+    for item, (x_end, y_end) in zip(horizon_items, ends):
         if item['pt'] is not None:
             ip = item['pt']
-            ax.scatter([ip.x], [ip.y], marker='x', color='blue', s=40)
             txt = f"{item['deg']}°"
             ax.text(ip.x, ip.y, txt, fontsize=FONT_SIZE_HORIZON, color='blue', ha='left', va='bottom')
         else:
@@ -416,21 +890,21 @@ def plot_scene(gdf, target_idx, centroid, horizon_items, orientation_results, ou
     try:
         mbrect_geom = orientation_results.get('mbrect_geom')
         if mbrect_geom:
-            gpd.GeoSeries([mbrect_geom], crs=gdf.crs).plot(
-                ax=base, facecolor='none', edgecolor='blue', linestyle=':', 
-                linewidth=1.5, label='MBRect')
+            # Contorno diretto dalle coordinate (niente GeoSeries per una sola geometria)
+            ring = shapely.get_coordinates(shapely.get_exterior_ring(mbrect_geom))
+            ax.plot(ring[:, 0], ring[:, 1], color='blue', linestyle=':', linewidth=1.5, label='MBRect')
 
         midpoints = orientation_results.get('long_sides_midpoints', [])
         chosen_midpoint_coord = orientation_results.get('chosen_long_side_midpoint')
         
         if midpoints:
-            other_midpoints_pts = []
-            for pt in midpoints:
-                if chosen_midpoint_coord and math.isclose(pt.x, chosen_midpoint_coord[0]) and math.isclose(pt.y, chosen_midpoint_coord[1]):
-                    continue
-                other_midpoints_pts.append(pt)
-            if other_midpoints_pts:
-                ax.scatter([pt.x for pt in other_midpoints_pts], [pt.y for pt in other_midpoints_pts],
+            mxy = shapely.get_coordinates(np.asarray(midpoints, dtype=object))
+            if chosen_midpoint_coord:
+                chosen = np.isclose(mxy[:, 0], chosen_midpoint_coord[0], rtol=1e-9, atol=0) & \
+                         np.isclose(mxy[:, 1], chosen_midpoint_coord[1], rtol=1e-9, atol=0)
+                mxy = mxy[~chosen]
+            if len(mxy):
+                ax.scatter(mxy[:, 0], mxy[:, 1],
                            color='blue', marker='o', s=50, alpha=0.8,
                            label='Other long side midpoint')
         
@@ -496,7 +970,7 @@ def plot_scene(gdf, target_idx, centroid, horizon_items, orientation_results, ou
 
     ax.legend(handles=legend_elements, loc='best', fontsize=FONT_SIZE_HORIZON)
     
-    plt.savefig(out_png, dpi=400, bbox_inches='tight') 
+    plt.savefig(out_png, dpi=dpi, bbox_inches='tight')
     print(f"\nPlot saved to: {out_png}")
     plt.close(fig)
 
@@ -546,18 +1020,23 @@ def run_orientation_tests():
 # ----------------------
 
 def main(zip_path):
-    tmpdir = tempfile.mkdtemp(prefix='pv_horizon_')
+    tmpdir = None
     summary_data = {}
     
     target_idx = TARGET_BUILDING_INDEX
     
     try:
-        shp_paths = extract_zip_find_shp(zip_path, tmpdir)
-        shp = pick_building_shp(shp_paths)
+        # Lettura diretta dallo zip (GDAL /vsizip/), estrazione su disco solo come fallback
+        try:
+            shp = pick_building_shp(list_zip_shp(zip_path))
+            gdf = read_building_layer(shp)
+        except Exception as e:
+            print(f"Could not read shapefile from ZIP directly ({e}), extracting...")
+            tmpdir = tempfile.mkdtemp(prefix='pv_horizon_')
+            shp = pick_building_shp(extract_zip_find_shp(zip_path, tmpdir))
+            gdf = read_building_layer(shp)
         print(f"Using shapefile: {shp}")
 
-        gdf = gpd.read_file(shp)
-
         if gdf.empty:
             raise ValueError("The building layer is empty")
         
@@ -568,9 +1047,11 @@ def main(zip_path):
             print("Input layer has no CRS – assuming EPSG:4326 (lon/lat).")
             gdf = gdf.set_crs(epsg=4326)
 
-        gdf_ll = gdf.to_crs(epsg=4326)
-        rep_point = gdf_ll.union_all().centroid
-        lon, lat = rep_point.x, rep_point.y
+        # Zona UTM dal punto medio dei bounds (4 float) invece di riproiettare tutto
+        # in EPSG:4326 per un union_all().centroid: una sola riproiezione del layer
+        minx, miny, maxx, maxy = gdf.total_bounds
+        to_ll = Transformer.from_crs(gdf.crs, 4326, always_xy=True)
+        lon, lat = to_ll.transform((minx + maxx) / 2, (miny + maxy) / 2)
         utm_epsg = lonlat_to_utm_epsg(lon, lat)
         print(f"Reprojecting geometries to UTM EPSG:{utm_epsg} for metric calculations")
         gdf = gdf.to_crs(epsg=utm_epsg)
@@ -599,9 +1080,7 @@ def main(zip_path):
         
         plot_scene(gdf, target_idx, centroid, horizon_items, orientation_results, out_png=PLOT_OUTPUT)
 
-        centroid_ll = gpd.GeoSeries([centroid], crs=f"EPSG:{utm_epsg}").to_crs(epsg=4326).iloc[0]
-        lat_pt = centroid_ll.y
-        lon_pt = centroid_ll.x
+        lon_pt, lat_pt = Transformer.from_crs(utm_epsg, 4326, always_xy=True).transform(centroid.x, centroid.y)
         
         pvgis_aspect = orientation_results['pvgis_aspect']
         
@@ -673,23 +1152,30 @@ def main(zip_path):
             'horizon_degrees': horizon_degrees
         }
         
-        with open(SUMMARY_OUTPUT, 'w') as f:
-            def json_converter(o):
-                if isinstance(o, np.integer):
-                    return int(o)
-                if isinstance(o, np.floating):
-                    return float(o)
-                if isinstance(o, np.ndarray):
-                    return o.tolist()
-                return str(o)
-
-            json.dump(summary_data, f, indent=2, default=json_converter)
+        def json_converter(o):
+            if isinstance(o, np.integer):
+                return int(o)
+            if isinstance(o, np.floating):
+                return float(o)
+            if isinstance(o, np.ndarray):
+                return o.tolist()
+            return str(o)
+
+        if orjson is not None:
+            # Tipi numpy gestiti da orjson; NaN diventa null (JSON valido)
+            with open(SUMMARY_OUTPUT, 'wb') as f:
+                f.write(orjson.dumps(summary_data, default=json_converter, option=(
+                    orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)))
+        else:
+            with open(SUMMARY_OUTPUT, 'w') as f:
+                json.dump(summary_data, f, indent=2, default=json_converter)
         print(f"Summary saved to: {SUMMARY_OUTPUT}")
 
 
     finally:
         try:
-            shutil.rmtree(tmpdir)
+            if tmpdir is not None:
+                shutil.rmtree(tmpdir)
         except Exception as e:
             print(f"Warning: could not clean up temp dir {tmpdir}. {e}")
 
@@ -1,8 +1,14 @@
 # app/db/init_db.py
 from __future__ import annotations
 from pathlib import Path
+import atexit
+import os
 import sqlite3
+import threading
+from contextlib import contextmanager
 from datetime import datetime
+from itertools import islice
+from typing import Iterable, Iterator, Sequence
 
 DB_PATH = Path("db/app.sqlite")
 
@@ -15,7 +21,9 @@ CREATE TABLE IF NOT EXISTS PROJECTS (
   description TEXT,
   country_code TEXT,
   created_at TEXT NOT NULL,
-  db_version INTEGER NOT NULL DEFAULT 1
+  db_version INTEGER NOT NULL DEFAULT 1,
+  slug TEXT,                   -- cartella in data/projects (indice univoco)
+  mtime_ns INTEGER             -- mtime di project.json, NULL se non ancora scritto
 );
 
 CREATE TABLE IF NOT EXISTS LAYERS (
@@ -27,6 +35,7 @@ CREATE TABLE IF NOT EXISTS LAYERS (
   features_count INTEGER NOT NULL,
   bbox_minx REAL, bbox_miny REAL, bbox_maxx REAL, bbox_maxy REAL,
   imported_at TEXT NOT NULL,
+  source_sig TEXT,             -- firma dei file sorgente (path/mtime/size, accessori inclusi)
   FOREIGN KEY(project_id) REFERENCES PROJECTS(id) ON DELETE CASCADE
 );
 
@@ -43,13 +52,305 @@ CREATE TABLE IF NOT EXISTS BUILDINGS (
   attrs_json TEXT,
   FOREIGN KEY(layer_id) REFERENCES LAYERS(id) ON DELETE CASCADE
 );
+
+-- Cache della tabella attributi: colonne e righe (già come stringhe) per layer
+CREATE TABLE IF NOT EXISTS ATTR_COLUMNS (
+  layer_id INTEGER NOT NULL,
+  col_idx INTEGER NOT NULL,
+  name TEXT NOT NULL,
+  PRIMARY KEY(layer_id, col_idx),
+  FOREIGN KEY(layer_id) REFERENCES LAYERS(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS ATTR_ROWS (
+  layer_id INTEGER NOT NULL,
+  row_idx INTEGER NOT NULL,
+  col_json TEXT NOT NULL,      -- lista JSON dei valori nell'ordine di ATTR_COLUMNS
+  PRIMARY KEY(layer_id, row_idx),
+  FOREIGN KEY(layer_id) REFERENCES LAYERS(id) ON DELETE CASCADE
+);
+
+-- Indici sulle FK (lookup per layer/progetto senza full scan)
+CREATE INDEX IF NOT EXISTS idx_buildings_layer  ON BUILDINGS(layer_id);
+CREATE INDEX IF NOT EXISTS idx_layers_project   ON LAYERS(project_id);
+CREATE INDEX IF NOT EXISTS idx_buildings_extid  ON BUILDINGS(layer_id, ext_id);
 """
 
-def ensure_db() -> None:
+# Indice R*Tree sui bbox degli edifici (modulo rtree di SQLite, opzionale nella build)
+RTREE_DDL = """
+CREATE VIRTUAL TABLE IF NOT EXISTS BUILDINGS_RTREE USING rtree(id, minx, maxx, miny, maxy);
+
+CREATE TRIGGER IF NOT EXISTS trg_buildings_rtree_delete AFTER DELETE ON BUILDINGS
+BEGIN
+  DELETE FROM BUILDINGS_RTREE WHERE id = old.id;
+END;
+"""
+
+# WAL + sync NORMAL: un solo fsync al checkpoint invece che ad ogni commit
+PRAGMAS = """
+PRAGMA journal_mode = WAL;
+PRAGMA synchronous = NORMAL;
+PRAGMA temp_store = MEMORY;
+PRAGMA cache_size = -65536;
+"""
+
+# Limite parametri per statement delle build SQLite più vecchie
+SQLITE_MAX_VARIABLES = 999
+BULK_CHUNK_ROWS = 1000
+
+BUILDINGS_COLUMNS = (
+    "layer_id", "ext_id", "centroid_lon", "centroid_lat", "floors",
+    "area_m2", "volume_m3", "year", "use", "attrs_json",
+)
+
+
+def apply_pragmas(con: sqlite3.Connection) -> None:
+    """Pragma di connessione (journal_mode resta persistente nel file)."""
+    con.executescript(PRAGMAS)
+
+
+def _migrate(con: sqlite3.Connection) -> None:
+    """Colonne aggiunte dopo la prima versione dello schema (DB già esistenti)."""
+    cols = {r[1] for r in con.execute("PRAGMA table_info(PROJECTS)")}
+    if "slug" not in cols:
+        con.execute("ALTER TABLE PROJECTS ADD COLUMN slug TEXT")
+    if "mtime_ns" not in cols:
+        con.execute("ALTER TABLE PROJECTS ADD COLUMN mtime_ns INTEGER")
+    con.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_projects_slug ON PROJECTS(slug)")
+    if "source_sig" not in {r[1] for r in con.execute("PRAGMA table_info(LAYERS)")}:
+        con.execute("ALTER TABLE LAYERS ADD COLUMN source_sig TEXT")
+
+
+def connect(**kwargs) -> sqlite3.Connection:
+    """Apre connessione al DB applicativo (schema garantito, FK attive)."""
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    con = sqlite3.connect(DB_PATH)
+    con = sqlite3.connect(DB_PATH, **kwargs)
+    con.executescript(DDL)
     try:
-        con.executescript(DDL)
+        con.executescript(RTREE_DDL)
+    except sqlite3.OperationalError:  # SQLite senza modulo rtree
+        pass
+    _migrate(con)
+    apply_pragmas(con)
+    con.execute("PRAGMA foreign_keys = ON")
+    return con
+
+
+# Connessione condivisa dal processo (setup/pragma pagati una volta sola).
+# Autocommit (isolation_level=None): le transazioni sono esplicite in transaction();
+# il lock serializza l'uso tra thread (handler Reflex, asyncio.to_thread).
+_CON: sqlite3.Connection | None = None
+_CON_LOCK = threading.RLock()
+
+
+def get_con() -> sqlite3.Connection:
+    global _CON
+    with _CON_LOCK:
+        if _CON is None:
+            _CON = connect(check_same_thread=False, isolation_level=None)
+        return _CON
+
+
+def _close_con() -> None:
+    global _CON
+    with _CON_LOCK:
+        if _CON is not None:
+            _CON.close()
+            _CON = None
+
+
+atexit.register(_close_con)
+
+
+@contextmanager
+def session() -> Iterator[sqlite3.Connection]:
+    """Connessione condivisa sotto lock (letture/scritture in autocommit)."""
+    with _CON_LOCK:
+        yield get_con()
+
+
+@contextmanager
+def transaction() -> Iterator[sqlite3.Connection]:
+    """Connessione condivisa sotto lock, dentro BEGIN ... COMMIT (ROLLBACK su errore)."""
+    with _CON_LOCK:
+        con = get_con()
+        con.execute("BEGIN")
+        try:
+            yield con
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        con.execute("COMMIT")
+
+
+def ensure_db() -> None:
+    # connessione dedicata: quella condivisa nasce al primo uso nel processo che serve le richieste
+    con = connect()
+    try:
+        con.commit()
+        # statistiche per il planner (usa gli indici sulle FK)
+        con.execute("ANALYZE")
         con.commit()
     finally:
-        con.close()
\ No newline at end of file
+        con.close()
+
+
+def refresh_projects_index(con: sqlite3.Connection, projects_dir: Path, pending_only: bool = False) -> None:
+    """
+    Allinea PROJECTS alle cartelle di projects_dir (slug + mtime di project.json).
+    Con pending_only=True ricontrolla solo i progetti senza project.json
+    (la cartella viene creata prima del file).
+    """
+    now = datetime.now().isoformat()
+    known = dict(con.execute("SELECT slug, mtime_ns FROM PROJECTS WHERE slug IS NOT NULL"))
+    if pending_only:
+        slugs = {s for s, m in known.items() if m is None}
+    else:
+        try:
+            with os.scandir(projects_dir) as it:
+                slugs = {e.name for e in it if e.is_dir()}
+        except OSError:
+            slugs = set()
+        gone = [(s,) for s in known.keys() - slugs]
+        if gone:
+            con.executemany("DELETE FROM PROJECTS WHERE slug = ?", gone)
+
+    for slug in slugs:
+        try:
+            mtime_ns = (Path(projects_dir) / slug / "project.json").stat().st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        if slug not in known:
+            con.execute(
+                "INSERT INTO PROJECTS(name, created_at, slug, mtime_ns) VALUES (?, ?, ?, ?)",
+                (slug, now, slug, mtime_ns),
+            )
+        elif known[slug] != mtime_ns:
+            con.execute("UPDATE PROJECTS SET mtime_ns = ? WHERE slug = ?", (mtime_ns, slug))
+
+
+def list_indexed_projects(con: sqlite3.Connection) -> list[str]:
+    """Slug dei progetti indicizzati con un project.json."""
+    return [r[0] for r in con.execute(
+        "SELECT slug FROM PROJECTS WHERE slug IS NOT NULL AND mtime_ns IS NOT NULL ORDER BY slug"
+    )]
+
+
+def has_pending_projects(con: sqlite3.Connection) -> bool:
+    return con.execute(
+        "SELECT 1 FROM PROJECTS WHERE slug IS NOT NULL AND mtime_ns IS NULL LIMIT 1"
+    ).fetchone() is not None
+
+
+def bulk_insert(
+    con: sqlite3.Connection,
+    table: str,
+    columns: Sequence[str],
+    rows: Iterable[Sequence],
+    chunk_rows: int = BULK_CHUNK_ROWS,
+) -> int:
+    """
+    Inserisce le righe in un'unica transazione, a blocchi di `chunk_rows`, con
+    INSERT multi-riga VALUES (?,..),(?,..) fino al limite di parametri SQLite.
+    Se la connessione è già in transazione il commit resta al chiamante.
+    Ritorna il numero di righe inserite.
+    """
+    ncols = len(columns)
+    per_stmt = max(1, SQLITE_MAX_VARIABLES // ncols)
+    row_ph = "(" + ", ".join("?" * ncols) + ")"
+    head = f"INSERT INTO {table}({', '.join(columns)}) VALUES "
+    sql_multi = head + ", ".join([row_ph] * per_stmt)
+    sql_single = head + row_ph
+
+    own_tx = not con.in_transaction
+    if own_tx:
+        con.execute("BEGIN")
+    try:
+        n = 0
+        it = iter(rows)
+        while True:
+            chunk = [tuple(r) for r in islice(it, chunk_rows)]
+            if not chunk:
+                break
+            full = len(chunk) - len(chunk) % per_stmt
+            if full:
+                con.executemany(
+                    sql_multi,
+                    (
+                        [v for r in chunk[i:i + per_stmt] for v in r]
+                        for i in range(0, full, per_stmt)
+                    ),
+                )
+            if full < len(chunk):
+                con.executemany(sql_single, chunk[full:])
+            n += len(chunk)
+        if own_tx:
+            con.execute("COMMIT")
+        return n
+    except Exception:
+        if own_tx:
+            con.execute("ROLLBACK")
+        raise
+
+
+def _next_building_id(con: sqlite3.Connection) -> int:
+    row = con.execute(
+        "SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'BUILDINGS'), 0),"
+        " COALESCE((SELECT MAX(id) FROM BUILDINGS), 0))"
+    ).fetchone()
+    return int(row[0]) + 1
+
+
+def bulk_insert_buildings(
+    con: sqlite3.Connection,
+    rows: Iterable[Sequence],
+    bboxes: Iterable[Sequence[float]] | None = None,
+) -> int:
+    """
+    Bulk insert in BUILDINGS; ogni riga segue l'ordine di BUILDINGS_COLUMNS.
+    Con bboxes (minx, miny, maxx, maxy per riga, nel CRS del layer) popola anche
+    BUILDINGS_RTREE nella stessa transazione, con id espliciti condivisi.
+    """
+    if bboxes is None:
+        return bulk_insert(con, "BUILDINGS", BUILDINGS_COLUMNS, rows)
+
+    rows, bboxes = list(rows), list(bboxes)
+    if len(rows) != len(bboxes):
+        raise ValueError("rows e bboxes devono avere la stessa lunghezza")
+    own_tx = not con.in_transaction
+    if own_tx:
+        con.execute("BEGIN")
+    try:
+        base = _next_building_id(con)
+        n = bulk_insert(
+            con, "BUILDINGS", ("id",) + BUILDINGS_COLUMNS,
+            ((base + i, *r) for i, r in enumerate(rows)),
+        )
+        bulk_insert(
+            con, "BUILDINGS_RTREE", ("id", "minx", "maxx", "miny", "maxy"),
+            ((base + i, b[0], b[2], b[1], b[3]) for i, b in enumerate(bboxes)),
+        )
+        if own_tx:
+            con.execute("COMMIT")
+        return n
+    except Exception:
+        if own_tx:
+            con.execute("ROLLBACK")
+        raise
+
+
+def buildings_in_bbox(
+    con: sqlite3.Connection,
+    minx: float, miny: float, maxx: float, maxy: float,
+    layer_id: int | None = None,
+) -> list[tuple]:
+    """Righe BUILDINGS il cui bbox interseca quello richiesto (via BUILDINGS_RTREE)."""
+    sql = (
+        "SELECT b.* FROM BUILDINGS b JOIN BUILDINGS_RTREE r ON b.id = r.id"
+        " WHERE r.minx <= ? AND r.maxx >= ? AND r.miny <= ? AND r.maxy >= ?"
+    )
+    params: list = [maxx, minx, maxy, miny]
+    if layer_id is not None:
+        sql += " AND b.layer_id = ?"
+        params.append(layer_id)
+    return con.execute(sql + " ORDER BY b.id", params).fetchall()
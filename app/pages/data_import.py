@@ -5,16 +5,8 @@ from app.states.main_state import MainState, PLANHEAT_FIELDS
 
 def _field_row(label: str, key: str, required: bool) -> rx.Component:
     """Riga: etichetta + select (colonne disponibili) + stellina se required."""
-    # Selettore: lega al var "flat" corrispondente
-    value_var = {
-        "id": MainState.map_id,
-        "buildingUse": MainState.map_buildingUse,
-        "year": MainState.map_year,
-        "gfa": MainState.map_gfa,
-        "roof": MainState.map_roof,
-        "height": MainState.map_height,
-        "floors": MainState.map_floors,
-    }[key]
+    # Selettore: lega al var "flat" corrispondente (map_<key>), un solo lookup
+    value_var = getattr(MainState, f"map_{key}")
 
     return rx.hstack(
         rx.box(
@@ -2,11 +2,26 @@
 from __future__ import annotations
 from app.states.main_state import MainState
 from pathlib import Path
+from functools import lru_cache
+import asyncio
+import copy
+import multiprocessing
+import hashlib
 import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from operator import itemgetter
 from typing import Optional, Tuple, List
 
 import reflex as rx
-import geopandas as gpd
+
+try:
+    import ijson
+except ImportError:  # streaming JSON opzionale
+    ijson = None
 
 # app/pages/map.py
 
@@ -14,31 +29,234 @@ import geopandas as gpd
 
 # Servizio Folium esistente
 from app.services.folium_map import build_map_from_shp
+from app.services.attr_cache import ingest_layer_attributes, fetch_attr_page
+from app.services.spatial_index import build_layer_index, query_bbox as query_layer_bbox
+from app.services.geoparquet_cache import ensure_geoparquet
+from app.services.layer_signature import layer_signature
+from app.db.init_db import (
+    has_pending_projects,
+    list_indexed_projects,
+    refresh_projects_index,
+    transaction,
+)
 
 ASSETS_MAP = Path("assets/map.html")
 PROJECTS_DIR = Path("data/projects")
+BUILDINGS_INDEX_NAME = "buildings.strtree.pkl"
+BUILDINGS_PARQUET_NAME = "buildings.parquet"
 
 
 # ---------- Utility ----------
+# Processo dedicato alla costruzione delle mappe (folium/JSON tengono il GIL:
+# in un thread rallenterebbero gli altri handler Reflex). Creato al primo uso.
+_map_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _get_map_executor() -> ProcessPoolExecutor:
+    global _map_executor
+    if _map_executor is None:
+        # spawn: niente fork del server (thread, lock, connessione SQLite)
+        _map_executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    return _map_executor
+
+
+async def _run_map_build(build) -> None:
+    """
+    Esegue la build nel processo dedicato. Se il worker è morto (OOM, crash GDAL)
+    il pool resta rotto: lo si ricrea e si riprova una volta.
+    """
+    global _map_executor
+    for attempt in range(2):
+        try:
+            await asyncio.get_running_loop().run_in_executor(_get_map_executor(), build)
+            return
+        except BrokenProcessPool:
+            if _map_executor is not None:
+                _map_executor.shutdown(wait=False, cancel_futures=True)
+                _map_executor = None
+            if attempt:
+                raise
+
+
+def _ensure_layer_caches(slug: str, layer: Path) -> Optional[Path]:
+    """
+    Copia GeoParquet ordinata (Hilbert) e indice spaziale del layer, ricostruiti solo
+    se il layer è cambiato. L'indice è costruito sulla copia GeoParquet (sul layer se
+    la copia non è disponibile), la stessa sorgente per build_map e query_bbox.
+    Ritorna la copia GeoParquet o None.
+    """
+    gpq: Optional[Path] = None
+    try:
+        gpq = ensure_geoparquet(layer, PROJECTS_DIR / slug / BUILDINGS_PARQUET_NAME)
+    except Exception as e:
+        print(f"[MAP] GeoParquet non aggiornato: {e}")
+    try:
+        build_layer_index(gpq or layer, PROJECTS_DIR / slug / BUILDINGS_INDEX_NAME)
+    except Exception as e:
+        print(f"[MAP] Indice spaziale non aggiornato: {e}")
+    return gpq
+
+
+# mtime di PROJECTS_DIR all'ultima riscansione dell'indice progetti
+_projects_dir_mtime_ns: Optional[int] = None
+
+
 def _list_available_projects() -> List[str]:
-    """Slug progetti con un project.json valido."""
-    if not PROJECTS_DIR.exists():
+    """
+    Slug progetti con un project.json valido, dall'indice PROJECTS in SQLite.
+    La cartella viene riscansionata solo se il suo mtime cambia; i progetti
+    ancora senza project.json vengono ricontrollati singolarmente.
+    """
+    global _projects_dir_mtime_ns
+    try:
+        mtime_ns = PROJECTS_DIR.stat().st_mtime_ns
+    except OSError:
         return []
-    slugs: List[str] = []
-    for p in PROJECTS_DIR.iterdir():
-        if p.is_dir() and (p / "project.json").exists():
-            slugs.append(p.name)
-    return sorted(slugs)
+    with transaction() as con:
+        if mtime_ns != _projects_dir_mtime_ns:
+            refresh_projects_index(con, PROJECTS_DIR)
+            _projects_dir_mtime_ns = mtime_ns
+        elif has_pending_projects(con):
+            refresh_projects_index(con, PROJECTS_DIR, pending_only=True)
+        return list_indexed_projects(con)
+
+
+@lru_cache(maxsize=64)
+def _load_json_cached(path: str, mtime_ns: int) -> dict:
+    # nessun try qui: un parse fallito (file a metà scrittura) non resta in cache
+    return json.loads(Path(path).read_text(encoding="utf-8"))
 
 
 def _read_project_json(project_slug: str) -> Optional[dict]:
+    """project.json del progetto (parse in cache finché il file non cambia; sola lettura)."""
     pj = PROJECTS_DIR / project_slug / "project.json"
-    if not pj.exists():
+    try:
+        mtime_ns = pj.stat().st_mtime_ns
+        return _load_json_cached(str(pj), mtime_ns)
+    except (OSError, ValueError):
         return None
+
+
+def _remember_buildings_vector(project_slug: str, path: Path, kind: str) -> None:
+    """
+    Salva in project.json.layers il layer trovato dalla scansione (le chiamate
+    successive saltano la rglob). Scrittura atomica (file temporaneo + replace);
+    se nel frattempo project.json è stato modificato da altri non lo sovrascrive.
+    """
+    if kind == "geojson" and path.suffix.lower() != ".geojson":
+        return  # il ramo metadati accetta solo .geojson
+    pj = PROJECTS_DIR / project_slug / "project.json"
     try:
-        return json.loads(pj.read_text(encoding="utf-8"))
+        mtime_ns = pj.stat().st_mtime_ns
+        data = copy.deepcopy(_load_json_cached(str(pj), mtime_ns))
+    except (OSError, ValueError):
+        return
+    if not isinstance(data, dict):
+        return
+    layers = data.get("layers") if isinstance(data.get("layers"), dict) else {}
+    layers["buildings_shp" if kind == "shp" else "buildings_geojson"] = str(
+        path.relative_to(PROJECTS_DIR / project_slug)
+    )
+    data["layers"] = layers
+    tmp = pj.with_name(f".{pj.name}.{os.getpid()}.tmp")
+    try:
+        tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+        if pj.stat().st_mtime_ns != mtime_ns:
+            return  # aggiornato da un altro handler: vince la sua versione
+        tmp.replace(pj)
+    except OSError:
+        pass
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def _existing_files(root: Path, rels: List[str]) -> List[Path]:
+    """
+    Path (root/rel) dei file esistenti, nell'ordine di rels.
+    Una sola scandir per cartella invece di una stat per file.
+    """
+    listing: dict[Path, set[str]] = {}
+    out: List[Path] = []
+    for rel in rels:
+        path = root / rel
+        if path.parent not in listing:
+            try:
+                with os.scandir(path.parent) as it:
+                    listing[path.parent] = {e.name for e in it if e.is_file()}
+            except OSError:
+                listing[path.parent] = set()
+        if path.name in listing[path.parent]:
+            out.append(path)
+    return out
+
+
+def _map_cache_key(layer: Path, id_field: str, overlays: List[Path]) -> str:
+    """
+    Hash degli input della mappa: firma dei file sorgente del layer (accessori dello
+    shapefile inclusi, vedi layer_signature), degli overlay e campo id.
+    """
+    parts = (layer_signature(layer), id_field, tuple(layer_signature(o) for o in overlays))
+    return hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+
+_GEOJSON_TYPE_RE = re.compile(rb'"type"\s*:\s*"(?:FeatureCollection|Feature)"')
+_GEOJSON_SNIFF_BYTES = 4096
+
+
+def _is_geojson(path: Path) -> bool:
+    """
+    True se il file è una FeatureCollection/Feature GeoJSON.
+    Legge solo i primi byte; se l'intestazione non basta a decidere (file più
+    lungo del blocco letto) scorre il file con ijson, o lo parsa tutto se ijson
+    non è installato.
+    """
+    try:
+        with open(path, "rb") as f:
+            head = f.read(_GEOJSON_SNIFF_BYTES)
+            if _GEOJSON_TYPE_RE.search(head):
+                return True
+            if len(head) < _GEOJSON_SNIFF_BYTES or not head.lstrip().startswith(b"{"):
+                return False
+        if ijson is not None:
+            # Parse in streaming: memoria limitata, ci si ferma al "type" di primo livello
+            with open(path, "rb") as f:
+                for prefix, event, value in ijson.parse(f):
+                    if prefix == "type" and event == "string":
+                        return value in {"FeatureCollection", "Feature"}
+            return False
+        js = json.loads(path.read_text(encoding="utf-8", errors="ignore"))
+        return isinstance(js, dict) and js.get("type") in {"FeatureCollection", "Feature"}
     except Exception:
-        return None
+        return False
+
+
+def _scan_vector_candidates(proj_dir: Path) -> Tuple[List[Tuple[Path, int]], List[Tuple[Path, int]]]:
+    """
+    Una sola visita del progetto con os.scandir: (candidati .shp, candidati .geojson/.json)
+    come coppie (path, dimensione), con la stat presa dalla entry durante la scansione.
+    """
+    shps: List[Tuple[Path, int]] = []
+    gjs: List[Tuple[Path, int]] = []
+    stack = [str(proj_dir)]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                        continue
+                    ext = entry.name.rsplit(".", 1)[-1].lower()
+                    if ext == "shp":
+                        shps.append((Path(entry.path), entry.stat().st_size))
+                    elif ext in ("geojson", "json"):
+                        gjs.append((Path(entry.path), entry.stat().st_size))
+                except OSError:
+                    pass
+    return shps, gjs
 
 
 def _resolve_buildings_vector(project_slug: str) -> Tuple[Optional[Path], Optional[str]]:
@@ -47,7 +265,8 @@ def _resolve_buildings_vector(project_slug: str) -> Tuple[Optional[Path], Option
     altrimenti (None, None).
     Priorità:
       1) project.json.layers.{buildings_shp|buildings_geojson}
-      2) scansione ricorsiva .shp / .geojson (sceglie il file più grande)
+      2) scansione ricorsiva .shp / .geojson (sceglie il file più grande),
+         il risultato viene salvato in project.json per le chiamate successive
     """
     proj_dir = PROJECTS_DIR / project_slug
     if not proj_dir.exists():
@@ -70,24 +289,18 @@ def _resolve_buildings_vector(project_slug: str) -> Tuple[Optional[Path], Option
             return p, "geojson"
 
     # 2) Scansione ricorsiva
-    candidates_shp = list(proj_dir.rglob("*.shp"))
-    candidates_gj = list(proj_dir.rglob("*.geojson")) + list(proj_dir.rglob("*.json"))
+    candidates_shp, candidates_gj = _scan_vector_candidates(proj_dir)
 
     if candidates_shp:
-        shp_biggest = max(candidates_shp, key=lambda p: p.stat().st_size)
+        shp_biggest = max(candidates_shp, key=itemgetter(1))[0]
+        _remember_buildings_vector(project_slug, shp_biggest, "shp")
         return shp_biggest, "shp"
 
     if candidates_gj:
-        valid_gj = []
-        for c in candidates_gj:
-            try:
-                js = json.loads(c.read_text(encoding="utf-8", errors="ignore"))
-                if js and isinstance(js, dict) and js.get("type") in {"FeatureCollection", "Feature"}:
-                    valid_gj.append(c)
-            except Exception:
-                pass
+        valid_gj = [c for c in candidates_gj if _is_geojson(c[0])]
         if valid_gj:
-            gj_biggest = max(valid_gj, key=lambda p: p.stat().st_size)
+            gj_biggest = max(valid_gj, key=itemgetter(1))[0]
+            _remember_buildings_vector(project_slug, gj_biggest, "geojson")
             return gj_biggest, "geojson"
 
     return None, None
@@ -106,11 +319,14 @@ class MapPageState(rx.State):
     # --- Attribute table state ---
     attr_open: bool = False                 # Mostra/nascondi sezione tabella
     attr_columns: list[str] = []            # Intestazioni
-    attr_rows: list[list[str]] = []         # Righe visibili (già pronte come lista di stringhe)
+    attr_columns_data: dict[str, list[str]] = {}  # Valori visibili per colonna (stringhe)
+    attr_row_ids: list[int] = []            # Indici delle righe visibili (per il render)
     attr_total: int = 0                     # Numero totale di righe
     attr_page: int = 1                      # Pagina corrente
     attr_page_size: int = 50                # Righe per pagina (modificabile)
     attr_error: str = ""                    # Messaggio errore eventuale
+    # --- Query spaziali (CRS del layer) ---
+    bbox_hits: list[int] = []               # Indici riga delle feature nel bbox richiesto
 
     # Lifecycle
     def on_load(self):
@@ -133,7 +349,7 @@ class MapPageState(rx.State):
     # dentro class MapPageState(rx.State):
 
     @rx.event
-    async def build_map(self, _evt: rx.event.PointerEventInfo | None = None) -> None:
+    async def build_map(self, _evt: rx.event.PointerEventInfo | None = None):
         
         from app.states.main_state import MainState 
         ms = await self.get_state(MainState)
@@ -161,35 +377,59 @@ class MapPageState(rx.State):
 
         #id_field = MainState.id_field_by_project.get(slug, "") or None
 
- #        3) Cartella output runtime
+        # 3) Cartella output runtime
         out_root = rx.get_upload_dir()
         maps_dir = out_root / "maps"
         maps_dir.mkdir(parents=True, exist_ok=True)
 
-        fname = f"map_{slug}_{self.reload_token + 1}.html"
-        out_html = maps_dir / fname
-
         # --- NEW: collect overlay paths (se presenti) ---
         overlay_geojsons = []
         if isinstance(ms.pvgis_overlay_geojsons, list):
-            for rel in ms.pvgis_overlay_geojsons:
-                p = out_root / rel  # i rel path vengono dal servizio
-                if p.exists():
-                    overlay_geojsons.append(p)
+            overlay_geojsons = _existing_files(out_root, ms.pvgis_overlay_geojsons)  # rel path dal servizio
+
+        # Chiave di idempotenza: stessi input (layer, id, overlay e relativi mtime) -> stesso HTML
+        key = _map_cache_key(p, id_field, overlay_geojsons)
+        fname = f"map_{slug}_{key}.html"
+        out_html = maps_dir / fname
+        if out_html.exists():
+            self.map_relpath = f"maps/{fname}"
+            self.last_status = f"Map up to date for '{slug}' ({kind})."
+            return
+
+        # stato intermedio: la UI si aggiorna prima del lavoro pesante
+        self.last_status = f"Building map for '{slug}' ({kind})..."
+        yield
+
+        # Import una tantum degli attributi in SQLite (la tabella attributi legge da lì)
+        try:
+            await asyncio.to_thread(ingest_layer_attributes, p, slug)
+        except Exception as e:
+            print(f"[MAP] Cache attributi non aggiornata: {e}")
+
+        # Copia GeoParquet (le build successive leggono questa) e indice spaziale
+        gpq = await asyncio.to_thread(_ensure_layer_caches, slug, p)
+
+        # scrittura su file temporaneo: in cache finisce solo un HTML completo
+        tmp_html = maps_dir / f".{fname}.tmp"
 
         try:
-            if kind == "shp":
-                from app.services.folium_map import build_map_from_shp
-                build_map_from_shp(p, out_html, id_field=id_field, overlay_geojsons=overlay_geojsons)
+            # Lettura, GEOS e scrittura HTML nel processo dedicato: l'event loop resta libero
+            from app.services.folium_map import build_map_from_geojson, build_map_from_parquet
+            if gpq is not None:
+                build = partial(build_map_from_parquet, gpq, tmp_html)
+            elif kind == "shp":
+                build = partial(build_map_from_shp, p, tmp_html)
             elif kind == "geojson":
-                from app.services.folium_map import build_map_from_geojson
-                build_map_from_geojson(p, out_html, id_field=id_field, overlay_geojsons=overlay_geojsons)
+                build = partial(build_map_from_geojson, p, tmp_html)
             else:
                 # ...
 
                 self.last_status = f"Tipo layer non supportato: {kind}"
                 self.map_relpath = ""
                 return
+            await _run_map_build(partial(build, id_field=id_field, overlay_geojsons=overlay_geojsons))
+
+            tmp_html.replace(out_html)
 
             # 4) Aggiorna stato e src per l'iframe
             self.map_relpath = f"maps/{fname}"   # <-- relativo alla upload dir
@@ -197,6 +437,7 @@ class MapPageState(rx.State):
             self.last_status = f"Map built for '{slug}' ({kind})."
 
         except Exception as e:
+            tmp_html.unlink(missing_ok=True)  # niente HTML parziali nella cartella mappe
             self.last_status = f"Errore: {e}"
             self.map_relpath = ""
             return
@@ -236,6 +477,27 @@ class MapPageState(rx.State):
                 self.project_slug = slug
         return slug or ""
     
+    @rx.event
+    async def query_bbox(self, minx: float, miny: float, maxx: float, maxy: float) -> None:
+        """Feature del layer edifici che intersecano il bbox (via STRtree salvato)."""
+        slug = self._resolve_active_slug()
+        if not slug:
+            self.bbox_hits = []
+            return
+        p, _ = _resolve_buildings_vector(slug)
+        if not p:
+            self.bbox_hits = []
+            return
+        try:
+            # stesse cache di build_map (no-op se aggiornate), fuori dall'event loop
+            await asyncio.to_thread(_ensure_layer_caches, slug, p)
+            self.bbox_hits = query_layer_bbox(
+                PROJECTS_DIR / slug / BUILDINGS_INDEX_NAME, float(minx), float(miny), float(maxx), float(maxy)
+            )
+        except Exception as e:
+            print(f"[MAP] Errore query bbox: {e}")
+            self.bbox_hits = []
+
     @rx.var
     def attr_range_text(self) -> str:
         if self.attr_total == 0:
@@ -258,30 +520,25 @@ class MapPageState(rx.State):
             return
 
         try:
-            # 1) Leggi attributi
-            gdf = gpd.read_file(str(p))
-            df = gdf.drop(columns=["geometry"]) if "geometry" in gdf.columns else gdf
+            # 1) Attributi dalla cache SQLite (import solo se il file è nuovo/modificato)
+            layer_id = ingest_layer_attributes(p, slug)
 
-            # 2) Metadati e bound pagina
-            total = len(df)
-            self.attr_total = int(total)
+            # 2) Solo le righe della pagina (LIMIT/OFFSET), pagina già riportata nei limiti
             self.attr_page_size = 50 if self.attr_page_size <= 0 else self.attr_page_size
-            max_page = max(1, (total + self.attr_page_size - 1) // self.attr_page_size)
-            page = min(max(1, page), max_page)
+            columns, data, total, page = fetch_attr_page(layer_id, page, self.attr_page_size)
 
-            # 3) Slice
-            start = (page - 1) * self.attr_page_size
-            end = min(start + self.attr_page_size, total)
-
-            # 4) Scrivi nello state (converti a str per robustezza)
-            self.attr_columns = [str(c) for c in df.columns]
-            self.attr_rows = df.iloc[start:end].astype(str).values.tolist()
+            # 3) Scrivi nello state (valori già salvati come stringhe, una lista per colonna)
+            self.attr_total = int(total)
+            self.attr_columns = columns
+            self.attr_columns_data = data
+            self.attr_row_ids = list(range(len(data[columns[0]]) if columns else 0))
             self.attr_page = page
             self.attr_error = ""
 
         except Exception as e:
             self.attr_error = f"Errore tabella: {e}"
-            self.attr_rows = []
+            self.attr_columns_data = {}
+            self.attr_row_ids = []
             self.attr_columns = []
 
 
@@ -353,11 +610,11 @@ def map_page() -> rx.Component:
                                 ),
                                 rx.el.tbody(
                                     rx.foreach(
-                                        MapPageState.attr_rows,
-                                        lambda row: rx.el.tr(
+                                        MapPageState.attr_row_ids,
+                                        lambda i: rx.el.tr(
                                             rx.foreach(
-                                                row,
-                                                lambda v: rx.el.td(rx.text(v))
+                                                MapPageState.attr_columns,
+                                                lambda c: rx.el.td(rx.text(MapPageState.attr_columns_data[c][i]))
                                             )
                                         ),
                                     )
@@ -163,12 +163,12 @@ def data_preview_card() -> rx.Component:
                 ),
                 rx.el.tbody(
                     rx.foreach(
-                        ProjectState.preview_data,
+                        ProjectState.preview_rows,
                         lambda row: rx.el.tr(
                             rx.foreach(
                                 ProjectState.source_columns,
                                 lambda col: rx.el.td(
-                                    row[col].to_string(),
+                                    row[col],
                                     class_name="px-4 py-2 text-sm text-gray-700",
                                 ),
                             ),
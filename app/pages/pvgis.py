@@ -99,15 +99,10 @@ def pvgis_page() -> rx.Component:
                 rx.cond(
                     MainState.selected_building != "",
                     rx.vstack(
-                        rx.foreach(
-                            MainState.pvgis_results_ui,
-
-                            lambda res: rx.cond(
-                                res["building_id"] == MainState.selected_building,
-                                building_result_card(res["building_id"], res),
-                                rx.fragment(),
-                            )
-
+                        rx.cond(
+                            MainState.selected_result.length() > 0,
+                            building_result_card(MainState.selected_building, MainState.selected_result),
+                            rx.fragment(),
                         ),
                         # Grafico horizon (se disponibile)
                         rx.cond(
@@ -0,0 +1,170 @@
+# app/services/attr_cache.py
+"""
+Cache SQLite della tabella attributi dei layer vettoriali:
+- il file (shp/geojson) viene letto una sola volta, senza geometrie e a blocchi
+  Arrow (skip_features/max_features), con conteggio e bbox dall'header OGR
+- colonne, righe, numero feature e bbox finiscono in LAYERS/ATTR_COLUMNS/ATTR_ROWS
+- il reimport scatta quando cambia la firma dei file sorgente (anche solo il .dbf)
+- le pagine della tabella si servono con LIMIT/OFFSET invece di rileggere il file
+"""
+from __future__ import annotations
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyogrio
+
+from app.db.init_db import bulk_insert, session, transaction
+from app.services.layer_signature import layer_signature
+
+# Feature lette per blocco durante l'import (memoria limitata su layer grandi)
+ATTR_INGEST_BATCH = 10_000
+# Formato dei campi float nella tabella attributi
+ATTR_FLOAT_FORMAT = "%.10g"
+
+
+def _arrow_strings(col: pa.ChunkedArray) -> list[str]:
+    """
+    Colonna Arrow -> lista di stringhe per la UI (null -> "").
+    Numeriche formattate in blocco con np.char.mod (loop C di NumPy), il resto
+    con il cast a stringa di Arrow.
+    """
+    t = col.type
+    if pa.types.is_integer(t) or pa.types.is_floating(t):
+        fmt = "%d" if pa.types.is_integer(t) else ATTR_FLOAT_FORMAT
+        out = np.char.mod(fmt, pc.fill_null(col, 0).to_numpy())
+        if col.null_count:
+            out[~pc.is_valid(col).to_numpy(zero_copy_only=False)] = ""
+        return out.tolist()
+    if not (pa.types.is_string(t) or pa.types.is_large_string(t)):
+        try:
+            col = pc.cast(col, pa.string())
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            return ["" if v is None else str(v) for v in col.to_pylist()]
+    return pc.fill_null(col, "").to_pylist()
+
+
+def _project_id(con: sqlite3.Connection, project_slug: str) -> int:
+    row = con.execute("SELECT id FROM PROJECTS WHERE slug = ?", (project_slug,)).fetchone()
+    if row:
+        return int(row[0])
+    # progetto non ancora indicizzato: mtime_ns lo completa refresh_projects_index
+    cur = con.execute(
+        "INSERT INTO PROJECTS(name, created_at, slug) VALUES (?, ?, ?)",
+        (project_slug, datetime.now().isoformat(), project_slug),
+    )
+    return int(cur.lastrowid)
+
+
+# Un lock per file: due import dello stesso layer non si sovrappongono
+# (gli altri accessi al DB non aspettano questi lock)
+_INGEST_LOCKS: dict[str, threading.Lock] = {}
+_INGEST_LOCKS_GUARD = threading.Lock()
+
+
+def _ingest_lock(path_str: str) -> threading.Lock:
+    with _INGEST_LOCKS_GUARD:
+        return _INGEST_LOCKS.setdefault(path_str, threading.Lock())
+
+
+def ingest_layer_attributes(vector_path: Path, project_slug: str, layer_name: str = "buildings") -> int:
+    """
+    Importa (una volta) gli attributi del layer nel DB e ritorna il layer_id.
+    Se il layer è già in cache con la stessa firma dei file sorgente
+    (.shp e accessori: path, mtime, dimensione) non legge nulla dal file.
+    Lettura e formattazione dei blocchi avvengono fuori dalle transazioni: la
+    connessione condivisa resta occupata solo per gli INSERT di ogni blocco.
+    """
+    vector_path = Path(vector_path)
+    path_str = str(vector_path.resolve())
+
+    with _ingest_lock(path_str):
+        sig = layer_signature(vector_path)
+        with transaction() as con:
+            project_id = _project_id(con, project_slug)
+            row = con.execute(
+                "SELECT id, source_sig FROM LAYERS WHERE project_id = ? AND name = ? AND path = ?",
+                (project_id, layer_name, path_str),
+            ).fetchone()
+        if row and row[1] == sig:
+            return int(row[0])
+
+        # Lettura solo attributi (niente decodifica geometrie), a blocchi di feature
+        info = pyogrio.read_info(str(vector_path))
+        bbox = info.get("total_bounds") or (None, None, None, None)
+
+        with transaction() as con:
+            if row:
+                # file modificati: il CASCADE elimina anche colonne/righe in cache
+                con.execute("DELETE FROM LAYERS WHERE id = ?", (row[0],))
+            # source_sig resta NULL finché l'import non è completo
+            cur = con.execute(
+                "INSERT INTO LAYERS(project_id, name, type, path, features_count,"
+                " bbox_minx, bbox_miny, bbox_maxx, bbox_maxy, imported_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (project_id, layer_name, layer_name, path_str, max(int(info["features"]), 0),
+                 *[None if v is None else float(v) for v in bbox],
+                 datetime.now().isoformat()),
+            )
+            layer_id = int(cur.lastrowid)
+            bulk_insert(
+                con, "ATTR_COLUMNS", ("layer_id", "col_idx", "name"),
+                ((layer_id, i, str(c)) for i, c in enumerate(info["fields"])),
+            )
+        n = 0
+        while True:
+            # blocco in Arrow (nessun DataFrame pandas / colonne object intermedie)
+            _, tbl = pyogrio.read_arrow(
+                str(vector_path), read_geometry=False,
+                skip_features=n, max_features=ATTR_INGEST_BATCH,
+            )
+            cols = [_arrow_strings(col) for col in tbl.columns]
+            rows = zip(*cols) if cols else ([] for _ in range(tbl.num_rows))
+            batch = [
+                (layer_id, n + i, json.dumps(list(vals), ensure_ascii=False))
+                for i, vals in enumerate(rows)
+            ]
+            with transaction() as con:
+                bulk_insert(con, "ATTR_ROWS", ("layer_id", "row_idx", "col_json"), batch)
+            n += tbl.num_rows
+            if tbl.num_rows < ATTR_INGEST_BATCH:
+                break
+        # conteggio effettivo (alcuni driver non lo riportano nell'header) e firma: layer completo
+        with transaction() as con:
+            con.execute(
+                "UPDATE LAYERS SET features_count = ?, source_sig = ? WHERE id = ?", (n, sig, layer_id)
+            )
+    return layer_id
+
+
+def fetch_attr_page(layer_id: int, page: int, page_size: int) -> tuple[list[str], dict[str, list[str]], int, int]:
+    """
+    Ritorna (colonne, valori della pagina per colonna, totale righe, pagina effettiva)
+    per il layer in cache; la pagina viene riportata nell'intervallo valido.
+    """
+    with session() as con:
+        columns = [
+            r[0] for r in con.execute(
+                "SELECT name FROM ATTR_COLUMNS WHERE layer_id = ? ORDER BY col_idx", (layer_id,)
+            )
+        ]
+        row = con.execute("SELECT features_count FROM LAYERS WHERE id = ?", (layer_id,)).fetchone()
+        total = int(row[0]) if row else 0
+        max_page = max(1, (total + page_size - 1) // page_size)
+        page = min(max(1, page), max_page)
+        # un solo parse JSON per tutta la pagina
+        rows = json.loads("[" + ",".join(
+            r[0] for r in con.execute(
+                "SELECT col_json FROM ATTR_ROWS WHERE layer_id = ? ORDER BY row_idx LIMIT ? OFFSET ?",
+                (layer_id, int(page_size), int((page - 1) * page_size)),
+            )
+        ) + "]")
+        # righe -> colonne (una lista per colonna)
+        cols_values = zip(*rows) if rows else ([] for _ in columns)
+        data = {c: list(v) for c, v in zip(columns, cols_values)}
+        return columns, data, total, page
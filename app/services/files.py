@@ -1,9 +1,14 @@
 # app/services/files.py
 from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import os
 import zipfile
 import shutil
 
+# Thread per l'estrazione dei membri dello zip (.shp/.shx/.dbf/.prj/.cpg in parallelo)
+EXTRACT_MAX_WORKERS = 8
+
 def save_upload(content: bytes, dest: Path) -> None:
     dest.parent.mkdir(parents=True, exist_ok=True)
     dest.write_bytes(content)
@@ -12,9 +17,28 @@ def extract_shapefile(zip_path: Path, out_dir: Path) -> Path:
     """Estrae lo shapefile .zip e ritorna il path al file .shp principale."""
     out_dir.mkdir(parents=True, exist_ok=True)
     with zipfile.ZipFile(zip_path, 'r') as zf:
-        zf.extractall(out_dir)
-    # cerca lo .shp
-    shp_list = list(out_dir.rglob("*.shp"))
+        infos = zf.infolist()
+    members = [i.filename for i in infos if not i.is_dir()]
+
+    # Cartelle create prima, in questo thread: ZipFile.extract fa makedirs senza
+    # exist_ok e da più thread sulla stessa cartella fallirebbe con FileExistsError
+    for info in infos:
+        # stessa normalizzazione del path di ZipFile.extract (separatori, unità, "." e "..")
+        name = os.path.splitdrive(info.filename.replace(os.sep, "/"))[1]
+        parts = [x for x in name.split("/") if x not in ("", ".", "..")]
+        target = out_dir.joinpath(*parts) if info.is_dir() else out_dir.joinpath(*parts[:-1])
+        target.mkdir(parents=True, exist_ok=True)
+
+    def _extract(names: list[str]) -> list[str]:
+        # un handle per thread: decompressione e scrittura si sovrappongono
+        with zipfile.ZipFile(zip_path, 'r') as zf:
+            return [zf.extract(n, out_dir) for n in names]
+
+    workers = max(1, min(EXTRACT_MAX_WORKERS, len(members)))
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        extracted = [p for batch in ex.map(_extract, (members[i::workers] for i in range(workers))) for p in batch]
+    # cerca lo .shp (prima tra i file estratti)
+    shp_list = [Path(p) for p in extracted if p.lower().endswith(".shp")] or list(out_dir.rglob("*.shp"))
     if not shp_list:
         raise FileNotFoundError("No .shp found inside ZIP")
     return shp_list[0]
@@ -2,8 +2,24 @@
 from __future__ import annotations
 from pathlib import Path
 import folium
+import io
 import json
 import geopandas as gpd
+import pyarrow.parquet as pq
+import pyogrio
+import shapely
+
+try:
+    import orjson  # opzionale: parse JSON più veloce
+except ImportError:
+    orjson = None
+
+# Cifre decimali delle coordinate WGS84 nel GeoJSON della mappa (7 ≈ 1 cm)
+GEOJSON_COORD_PRECISION = 7
+# Tolleranza di semplificazione = lato maggiore del bbox del layer * fattore
+MAP_SIMPLIFY_FACTOR = 1e-5
+# Feature lette per blocco dagli shapefile grandi (picco di memoria limitato a un blocco)
+MAP_READ_BATCH = 50_000
 
 # app/services/folium_map.py
 from folium.features import GeoJsonTooltip, GeoJsonPopup
@@ -51,6 +67,11 @@ def build_map_from_shp(shp_path: Path, out_html: Path, id_field: str | None = No
     m.save(out_html)
 
 
+ID_CANDIDATES = [
+    "building_id","b_id","id","ID","fid","FID","objectid","OBJECTID","OBJECTID_1","gid","GID"
+]
+
+
 def _guess_id_column(gdf: gpd.GeoDataFrame) -> str | None:
     """
     Prova a identificare la colonna ID più probabile.
@@ -58,12 +79,9 @@ def _guess_id_column(gdf: gpd.GeoDataFrame) -> str | None:
     Se non trovata, usa la prima colonna non geometrica con valori univoci;
     in ultima istanza, crea una colonna 'building_id' dal range index.
     """
-    candidates = [
-        "building_id","b_id","id","ID","fid","FID","objectid","OBJECTID","OBJECTID_1","gid","GID"
-    ]
     cols = [c for c in gdf.columns if c != "geometry"]
     lower_map = {c.lower(): c for c in cols}
-    for c in candidates:
+    for c in ID_CANDIDATES:
         if c in lower_map:
             return lower_map[c]
     # cerca una colonna con alta unicità
@@ -77,12 +95,75 @@ def _guess_id_column(gdf: gpd.GeoDataFrame) -> str | None:
     gdf["building_id"] = range(1, len(gdf) + 1)
     return "building_id"
 
+def _feature_collection(gdf: gpd.GeoDataFrame, columns: list[str]) -> dict:
+    """
+    FeatureCollection per folium scritta da GDAL (pyogrio, in memoria) invece di
+    __geo_interface__/to_json, che costruiscono le feature riga per riga in Python.
+    """
+    buf = io.BytesIO()
+    pyogrio.write_dataframe(
+        gdf[columns + ["geometry"]], buf, driver="GeoJSON", layer="buildings",
+        layer_options={"COORDINATE_PRECISION": GEOJSON_COORD_PRECISION, "RFC7946": "YES"},
+    )
+    raw = buf.getvalue()
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+
+def _simplify(gdf: gpd.GeoDataFrame, bounds) -> gpd.GeoDataFrame:
+    """
+    Semplificazione vettoriale (GEOS, un'unica chiamata): i vertici sotto la
+    risoluzione visibile non finiscono nell'HTML.
+    """
+    minx, miny, maxx, maxy = bounds
+    tol = max(maxx - minx, maxy - miny) * MAP_SIMPLIFY_FACTOR
+    if tol > 0:
+        gdf["geometry"] = shapely.simplify(gdf.geometry.values, tol, preserve_topology=False)
+        gdf = gdf[~gdf.geometry.is_empty]
+    return gdf
+
+
 def _add_buildings_layer(m: folium.Map, gdf: gpd.GeoDataFrame, id_field: str | None = None) -> None:
     gdf = _to_wgs84_and_fix(gdf)
     id_col = id_field or _guess_id_column(gdf)
+    bounds = gdf.total_bounds
+    gdf = _simplify(gdf, bounds)
+    _add_buildings_geojson(m, _feature_collection(gdf, [id_col]), id_col, bounds)
+
+
+def _add_buildings_layer_batched(m: folium.Map, path: Path, id_col: str, info: dict) -> None:
+    """
+    Come _add_buildings_layer, ma legge il layer a blocchi di MAP_READ_BATCH feature
+    (skip_features/max_features): in memoria resta un solo GeoDataFrame per volta,
+    di ogni blocco si tengono solo le feature GeoJSON già semplificate.
+    """
+    if info.get("crs") is None:
+        raise ValueError("CRS mancante: shapefile senza .prj. Imposta il CRS per proseguire.")
+    # tolleranza dal bbox dell'header OGR (riproiettato), uguale per tutti i blocchi
+    tb = info.get("total_bounds")
+    tol_bounds = gpd.GeoSeries([shapely.box(*tb)], crs=info["crs"]).to_crs(4326).total_bounds
+
+    features: list[dict] = []
+    bounds = [float("inf"), float("inf"), float("-inf"), float("-inf")]
+    off = 0
+    while True:
+        gdf = pyogrio.read_dataframe(
+            str(path), columns=[id_col], skip_features=off, max_features=MAP_READ_BATCH, use_arrow=True,
+        )
+        n_read = len(gdf)
+        gdf = _to_wgs84_and_fix(gdf)
+        if len(gdf):
+            bminx, bminy, bmaxx, bmaxy = gdf.total_bounds
+            bounds = [min(bounds[0], bminx), min(bounds[1], bminy), max(bounds[2], bmaxx), max(bounds[3], bmaxy)]
+            features += _feature_collection(_simplify(gdf, tol_bounds), [id_col])["features"]
+        off += n_read
+        if n_read < MAP_READ_BATCH:
+            break
+    _add_buildings_geojson(m, {"type": "FeatureCollection", "features": features}, id_col, bounds)
 
+
+def _add_buildings_geojson(m: folium.Map, data: dict, id_col: str, bounds) -> None:
     # bounding box & centro
-    minx, miny, maxx, maxy = gdf.total_bounds
+    minx, miny, maxx, maxy = bounds
     center = [(miny + maxy) / 2, (minx + maxx) / 2]
     m.location = center
 
@@ -122,7 +203,7 @@ def _add_buildings_layer(m: folium.Map, gdf: gpd.GeoDataFrame, id_field: str | N
     )
 
     folium.GeoJson(
-        data=gdf.__geo_interface__,
+        data=data,
         name="buildings",
         style_function=style_fn,
         highlight_function=highlight_fn,     # evidenzia il poligono al passaggio
@@ -138,63 +219,65 @@ def _add_buildings_layer(m: folium.Map, gdf: gpd.GeoDataFrame, id_field: str | N
 
 
 # ---------- public API ----------
-def build_map_from_shp(shp_path: Path, out_html: Path, id_field: str | None = None) -> None:
-    gdf = gpd.read_file(str(shp_path))
+def _add_overlays(m: folium.Map, overlay_geojsons: list[Path] | None) -> None:
+    for gj in overlay_geojsons or []:
+        name = gj.stem.replace("_", " ").title()
+        _add_geojson_overlay(m, gj, name)
+
+
+def _id_candidates_columns(fields: list[str], id_field: str | None) -> list[str] | None:
+    """
+    Colonne da leggere per la mappa: solo quella ID se risolvibile dai nomi dei campi,
+    altrimenti None (tutte: serve il controllo di unicità di _guess_id_column).
+    """
+    if id_field and id_field in fields:
+        return [id_field]
+    lower_map = {c.lower(): c for c in fields}
+    for c in ID_CANDIDATES:
+        if c in lower_map:
+            return [lower_map[c]]
+    return None
+
+
+def _read_buildings(path: Path, id_field: str | None = None) -> gpd.GeoDataFrame:
+    """Legge il layer con pyogrio (Arrow, lettura colonnare) e solo le colonne usate dalla mappa."""
+    fields = [str(c) for c in pyogrio.read_info(str(path))["fields"]]
+    return pyogrio.read_dataframe(str(path), columns=_id_candidates_columns(fields, id_field), use_arrow=True)
+
+
+def build_map_from_shp(shp_path: Path, out_html: Path, id_field: str | None = None,
+                       overlay_geojsons: list[Path] | None = None) -> None:
+    info = pyogrio.read_info(str(shp_path))
+    cols = _id_candidates_columns([str(c) for c in info["fields"]], id_field)
     # mappa base
     m = folium.Map(location=[45, 9], zoom_start=14, tiles="OpenStreetMap", control_scale=True)
-    _add_buildings_layer(m, gdf, id_field=id_field)
+    if cols is not None and int(info["features"]) > MAP_READ_BATCH and info.get("total_bounds") is not None:
+        # layer grande con colonna ID nota: lettura a blocchi
+        _add_buildings_layer_batched(m, shp_path, id_field or cols[0], info)
+    else:
+        gdf = pyogrio.read_dataframe(str(shp_path), columns=cols, use_arrow=True)
+        _add_buildings_layer(m, gdf, id_field=id_field)
+    _add_overlays(m, overlay_geojsons)
     out_html.parent.mkdir(parents=True, exist_ok=True)
     m.save(str(out_html))
 
-def build_map_from_geojson(geojson_path: Path, out_html: Path, id_field: str | None = None) -> None:
-    gdf = gpd.read_file(str(geojson_path))
+def build_map_from_parquet(parquet_path: Path, out_html: Path, id_field: str | None = None,
+                           overlay_geojsons: list[Path] | None = None) -> None:
+    """Come build_map_from_shp, ma dalla copia GeoParquet del layer (lettura colonnare)."""
+    fields = [f for f in pq.read_schema(str(parquet_path)).names if f not in ("geometry", "bbox")]
+    cols = _id_candidates_columns(fields, id_field)
+    gdf = gpd.read_parquet(str(parquet_path), columns=None if cols is None else cols + ["geometry"])
     m = folium.Map(location=[45, 9], zoom_start=14, tiles="OpenStreetMap", control_scale=True)
     _add_buildings_layer(m, gdf, id_field=id_field)
+    _add_overlays(m, overlay_geojsons)
     out_html.parent.mkdir(parents=True, exist_ok=True)
     m.save(str(out_html))
 
-#def build_map_from_shp(shp_path: Path, out_html: Path) -> None:
-    """Crea una mappa OSM con overlay dallo SHP (ri-proiettato al volo in EPSG:4326) e la salva in assets."""
-    if not shp_path.exists():
-        raise FileNotFoundError(f"Shapefile not found: {shp_path}")
-
-    gdf = gpd.read_file(shp_path)
-    if gdf.empty:
-        raise ValueError("Shapefile has no features")
-
-    # Leaflet/Folium si aspetta lon/lat in WGS84
-    if gdf.crs is None or gdf.crs.to_epsg() != 4326:
-        gdf = gdf.to_crs(4326)
-
-    minx, miny, maxx, maxy = gdf.total_bounds
-
-    m = folium.Map(tiles="OpenStreetMap")  # base OSM
-    # Passiamo l'overlay come GeoJSON "in memoria" (Nessun file .geojson su disco)
-    folium.GeoJson(data=gdf.to_json(), name="Buildings").add_to(m)
-    folium.LayerControl(collapsed=False).add_to(m)
-    m.fit_bounds([[miny, minx], [maxy, maxx]])
-
+def build_map_from_geojson(geojson_path: Path, out_html: Path, id_field: str | None = None,
+                           overlay_geojsons: list[Path] | None = None) -> None:
+    gdf = _read_buildings(geojson_path, id_field)
+    m = folium.Map(location=[45, 9], zoom_start=14, tiles="OpenStreetMap", control_scale=True)
+    _add_buildings_layer(m, gdf, id_field=id_field)
+    _add_overlays(m, overlay_geojsons)
     out_html.parent.mkdir(parents=True, exist_ok=True)
     m.save(str(out_html))
-
-#def build_map_from_geojson(geojson_path: Path, out_html: Path) -> None:
-    gdf = gpd.read_file(str(geojson_path))
-    # converti a WGS84 (EPSG:4326) e ripara geometrie:
-    if gdf.crs is None:
-        raise ValueError("CRS mancante: aggiungi il .prj o imposta il CRS.")
-    gdf = gdf.to_crs(4326)
-    gdf = gdf[gdf.geometry.notnull()].copy()
-    gdf["geometry"] = gdf.buffer(0)
-
-    minx, miny, maxx, maxy = gdf.total_bounds
-    center = [(miny + maxy)/2, (minx + maxx)/2]
-    m = folium.Map(location=center, zoom_start=14, tiles="OpenStreetMap", control_scale=True)
-    folium.GeoJson(
-        gdf.__geo_interface__,
-        name="buildings",
-        style_function=lambda f: {"color": "#ff7800", "weight": 1, "fillOpacity": 0.35},
-    ).add_to(m)
-    folium.LayerControl().add_to(m)
-    m.fit_bounds([[miny, minx], [maxy, maxx]])
-    out_html.parent.mkdir(parents=True, exist_ok=True)
-    m.save(str(out_html))
\ No newline at end of file
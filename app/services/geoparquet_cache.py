@@ -0,0 +1,62 @@
+# app/services/geoparquet_cache.py
+"""
+Copia GeoParquet del layer edifici, accanto al progetto:
+- righe ordinate lungo la curva di Hilbert (feature vicine nello stesso row group)
+- colonna bbox di copertura + statistiche per row group: i filtri spaziali
+  saltano i row group fuori dal bbox
+- l'indice originale resta nel file, quindi gli id riga non cambiano
+- ricostruita quando cambia la firma dei file sorgente (anche solo il .dbf
+  o un layer diverso), salvata accanto alla copia
+"""
+from __future__ import annotations
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pyogrio
+
+from app.services.layer_signature import (
+    invalidate_derived,
+    is_derived_current,
+    layer_signature,
+    mark_derived_current,
+)
+
+GEOPARQUET_ROW_GROUP = 10_000
+
+
+def ensure_geoparquet(vector_path: Path, parquet_path: Path) -> Path:
+    """Converte shp/geojson in GeoParquet se manca o è stato costruito da altri file sorgente."""
+    vector_path, parquet_path = Path(vector_path), Path(parquet_path)
+    if is_derived_current(parquet_path, vector_path):
+        return parquet_path
+    sig = layer_signature(vector_path)
+    invalidate_derived(parquet_path)
+
+    gdf = pyogrio.read_dataframe(str(vector_path))
+    geom = gdf.geometry
+    valid = (geom.notna() & ~geom.is_empty).to_numpy()
+    # geometrie nulle/vuote in coda (Hilbert non è definita su di esse)
+    key = np.full(len(gdf), np.iinfo(np.int64).max, dtype=np.int64)
+    if valid.any():
+        gvalid = geom[valid]
+        key[valid] = gvalid.hilbert_distance(total_bounds=gvalid.total_bounds).to_numpy(dtype=np.int64)
+    gdf = gdf.iloc[np.argsort(key, kind="stable")]
+
+    parquet_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = parquet_path.with_suffix(".tmp.parquet")
+    gdf.to_parquet(
+        tmp,
+        compression="zstd",
+        row_group_size=GEOPARQUET_ROW_GROUP,
+        write_covering_bbox=True,
+    )
+    tmp.replace(parquet_path)
+    mark_derived_current(parquet_path, sig)
+    return parquet_path
+
+
+def read_geoparquet(parquet_path: Path, bbox: tuple[float, float, float, float] | None = None,
+                    columns: list[str] | None = None) -> gpd.GeoDataFrame:
+    """Legge la copia GeoParquet, opzionalmente solo le feature nel bbox (CRS del layer)."""
+    return gpd.read_parquet(str(parquet_path), bbox=bbox, columns=columns)
@@ -0,0 +1,55 @@
+# app/services/layer_signature.py
+"""
+Firma dei file sorgente di un layer vettoriale (path + mtime_ns + size):
+- per gli shapefile comprende .dbf/.shx/.prj/.cpg (QGIS modifica gli attributi
+  riscrivendo solo il .dbf)
+- usata dalle cache derivate dal layer (attributi, GeoParquet, indice spaziale)
+  per sapere se vanno ricostruite
+"""
+from __future__ import annotations
+import hashlib
+from pathlib import Path
+
+# File accessori dello shapefile che cambiano contenuto del layer (attributi, indice, CRS)
+SHP_SIDECAR_SUFFIXES = (".dbf", ".shx", ".prj", ".cpg")
+
+
+def layer_source_files(path: Path) -> list[Path]:
+    """Il file del layer più, per gli shapefile, gli accessori presenti."""
+    path = Path(path)
+    files = [path]
+    if path.suffix.lower() == ".shp":
+        files += [f for f in (path.with_suffix(s) for s in SHP_SIDECAR_SUFFIXES) if f.exists()]
+    return files
+
+
+def layer_signature(path: Path) -> str:
+    """Hash di path, mtime_ns e dimensione dei file sorgente del layer."""
+    parts = []
+    for f in layer_source_files(path):
+        st = f.stat()
+        parts.append((str(f.resolve()), st.st_mtime_ns, st.st_size))
+    return hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+
+def _signature_file(derived: Path) -> Path:
+    return derived.with_name(derived.name + ".sig")
+
+
+def is_derived_current(derived: Path, source: Path) -> bool:
+    """True se `derived` esiste ed è stato costruito dai file sorgente attuali di `source`."""
+    derived = Path(derived)
+    try:
+        return derived.exists() and _signature_file(derived).read_text() == layer_signature(source)
+    except OSError:
+        return False
+
+
+def invalidate_derived(derived: Path) -> None:
+    """Da chiamare prima di ricostruire `derived`: senza firma non viene più considerato valido."""
+    _signature_file(Path(derived)).unlink(missing_ok=True)
+
+
+def mark_derived_current(derived: Path, signature: str) -> None:
+    """Registra la firma dei sorgenti da cui `derived` è stato costruito (calcolata prima della lettura)."""
+    _signature_file(Path(derived)).write_text(signature)
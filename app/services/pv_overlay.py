@@ -104,13 +104,15 @@ def build_pv_geojson_layers(gdf_utm: gpd.GeoDataFrame, results: dict,
     colors = quintile_colors()
 
     rect_rows = []
-    for idx, row in gdf_utm.iterrows():
+    for idx, geom in zip(gdf_utm.index, gdf_utm.geometry.values):
         r = results.get(idx)
         if not r: continue
         long_side = (r.get("building_props", {}) or {}).get("long_side_endpoints")
         if not long_side or len(long_side) != 2:  # serve per creare il rettangolo
             continue
-        centroid = row.geometry.centroid
+        # centroide già calcolato dall'analisi PVGIS (evita la chiamata GEOS)
+        cxy = (r.get("location") or {}).get("centroid_xy")
+        centroid = Point(cxy) if cxy is not None else geom.centroid
         rect = create_panel_rectangle(centroid, long_side[0], long_side[1])
         if rect is None or rect.is_empty: continue
         energy = r["annual_metrics"]["energy_kwh"]
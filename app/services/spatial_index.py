@@ -0,0 +1,62 @@
+# app/services/spatial_index.py
+"""
+Indice spaziale (shapely STRtree) per i layer vettoriali:
+- costruito una volta dalle sole geometrie del layer e salvato con pickle
+- ricostruito solo se cambia la firma dei file sorgente (path, mtime, dimensione,
+  accessori dello shapefile inclusi), salvata accanto all'indice
+- interrogazioni per bbox in O(log N) invece della scansione del GeoDataFrame
+"""
+from __future__ import annotations
+import pickle
+from functools import lru_cache
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pyogrio
+import shapely
+
+from app.services.layer_signature import (
+    invalidate_derived,
+    is_derived_current,
+    layer_signature,
+    mark_derived_current,
+)
+
+
+def build_layer_index(vector_path: Path, index_path: Path) -> Path:
+    """Costruisce e salva (tree, indici riga) se l'indice manca o è stato costruito da altri file."""
+    vector_path, index_path = Path(vector_path), Path(index_path)
+    if is_derived_current(index_path, vector_path):
+        return index_path
+    sig = layer_signature(vector_path)
+    invalidate_derived(index_path)
+
+    # solo geometrie, nessun attributo
+    if vector_path.suffix.lower() == ".parquet":
+        df = gpd.read_parquet(str(vector_path), columns=["geometry"])
+    else:
+        df = pyogrio.read_dataframe(str(vector_path), columns=[])
+    tree = shapely.STRtree(np.asarray(df.geometry.values))
+
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = index_path.with_suffix(index_path.suffix + ".tmp")
+    with open(tmp, "wb") as f:
+        pickle.dump((tree, df.index.to_numpy()), f, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp.replace(index_path)
+    mark_derived_current(index_path, sig)
+    return index_path
+
+
+@lru_cache(maxsize=8)
+def _load_index(index_path: str, mtime_ns: int):
+    with open(index_path, "rb") as f:
+        return pickle.load(f)
+
+
+def query_bbox(index_path: Path, minx: float, miny: float, maxx: float, maxy: float) -> list[int]:
+    """Indici riga (nel CRS del layer) delle feature che intersecano il bbox."""
+    index_path = Path(index_path)
+    tree, row_index = _load_index(str(index_path), index_path.stat().st_mtime_ns)
+    hits = tree.query(shapely.box(minx, miny, maxx, maxy), predicate="intersects")
+    return row_index[np.sort(hits)].tolist()
@@ -1,10 +1,12 @@
 # app/states/main_state.py
 from __future__ import annotations
+from functools import lru_cache
 from pathlib import Path
 from typing import Literal, Dict
 import json
 import pandas as pd
 import geopandas as gpd  # modulo-level, non dentro la classe
+import pyogrio
 import reflex as rx
 
 from app.services.pv_overlay import build_pv_geojson_layers
@@ -25,6 +27,20 @@ PLANHEAT_FIELDS = [
 ]
 
 
+@lru_cache(maxsize=32)
+def _project_shp_from_json(slug: str, mtime_ns: int) -> Path | None:
+    """layers.buildings_shp di project.json (parse in cache finché mtime_ns non cambia)."""
+    try:
+        data = json.loads((PROJECTS_DIR / slug / "project.json").read_text(encoding="utf-8"))
+        shp = data["layers"]["buildings_shp"]
+    except Exception:
+        return None
+    if not isinstance(shp, str) or not shp:
+        return None
+    p = Path(shp)
+    return p if p.is_absolute() else PROJECTS_DIR / slug / p
+
+
 class MainState(rx.State):
     # --- PROGETTI ---
     projects: list[str] = []
@@ -79,6 +95,12 @@ class MainState(rx.State):
 
     def _resolve_project_shp(self, slug: str) -> Path | None:
         proj_dir = PROJECTS_DIR / slug
+        try:
+            shp = _project_shp_from_json(slug, (proj_dir / "project.json").stat().st_mtime_ns)
+        except OSError:
+            shp = None
+        if shp is not None and shp.suffix.lower() == ".shp" and shp.exists():
+            return shp
         if not proj_dir.exists():
             return None
         shp_list = list(proj_dir.rglob("*.shp"))
@@ -144,8 +166,8 @@ class MainState(rx.State):
             return
 
         try:
-            gdf = gpd.read_file(str(shp))
-            cols = [c for c in gdf.columns if c != "geometry"] if "geometry" in gdf.columns else list(gdf.columns)
+            # Solo i nomi dei campi dall'header OGR: nessuna feature/geometria letta
+            cols = [str(c) for c in pyogrio.read_info(str(shp))["fields"]]
 
             # Selezione colonna ID (preferisci quella salvata o euristica)
             saved = self.id_field_by_project.get(slug, "")
@@ -301,8 +323,7 @@ class MainState(rx.State):
         }
 
         try:
-            gdf = gpd.read_file(str(shp))
-            cols = set([c for c in gdf.columns if c != "geometry"])
+            cols = set(str(c) for c in pyogrio.read_info(str(shp))["fields"])
 
             # 1) esistenza
             not_found = [lbl for key, lbl, _, _ in PLANHEAT_FIELDS if mapping.get(key) and mapping[key] not in cols]
@@ -314,7 +335,10 @@ class MainState(rx.State):
             # 2) numericità per alcuni campi (sample)
             numeric_keys = [("year", "int"), ("gfa", "float"), ("roof", "float"), ("height", "float"), ("floors", "int")]
             bad = []
-            sample = gdf.sample(min(500, len(gdf)), random_state=42) if len(gdf) > 500 else gdf
+            # solo le colonne numeriche mappate, senza decodificare le geometrie
+            read_cols = list(dict.fromkeys(mapping[k] for k, _ in numeric_keys if mapping.get(k)))
+            df = pyogrio.read_dataframe(str(shp), columns=read_cols, read_geometry=False) if read_cols else pd.DataFrame()
+            sample = df.sample(min(500, len(df)), random_state=42) if len(df) > 500 else df
             for key, expected in numeric_keys:
                 col = mapping.get(key)
                 if not col:
@@ -495,12 +519,12 @@ class MainState(rx.State):
         self.auto_step_pvgis = not self.auto_step_pvgis
 
     @rx.var
-    def pvgis_results_ui(self) -> list[dict]:
-        """Restituisce i risultati PVGIS già formattati per la UI."""
-        out: list[dict] = []
+    def pvgis_results_by_id(self) -> dict[str, dict[str, str]]:
+        """Risultati PVGIS già formattati per la UI, indicizzati per ID edificio."""
+        out: dict[str, dict[str, str]] = {}
         for idx, res in self.pvgis_results.items():
             if res is not None:
-                out.append({
+                out[str(idx)] = {
                     "building_id": str(idx),
                     "energy": f"{res['annual_metrics']['energy_kwh']:.2f}",
                     "cf": f"{res['annual_metrics']['capacity_factor']:.3f}",
@@ -508,9 +532,19 @@ class MainState(rx.State):
                     "avg_power": f"{res['annual_metrics']['avg_power_w']:.2f}",
                     "max_power": f"{res['annual_metrics']['max_power_w']:.2f}",
                     "peak_hours": f"{res['annual_metrics']['peak_hours_h']:.2f}",
-                })
+                }
         return out
 
+    @rx.var
+    def pvgis_results_ui(self) -> list[dict]:
+        """Restituisce i risultati PVGIS già formattati per la UI."""
+        return list(self.pvgis_results_by_id.values())
+
+    @rx.var
+    def selected_result(self) -> dict[str, str]:
+        """Risultato formattato dell'edificio selezionato (vuoto se nessuno)."""
+        return self.pvgis_results_by_id.get(self.selected_building, {})
+
     # Selezione edificio
     selected_building: str = ""
 
@@ -6,6 +6,8 @@ import json
 import re
 from typing import Optional
 
+import pandas as pd
+import pyogrio
 import reflex as rx
 from app.services.files import save_upload, extract_shapefile, clean_dir
 
@@ -14,6 +16,8 @@ from app.services.files import save_upload, extract_shapefile, clean_dir
 # --------------------------------------------------------------------
 REQUIRED_BUILDING_FIELDS = ("id", "area_m2", "year", "use")
 OPTIONAL_BUILDING_FIELDS = ("floors", "volume_m3")
+# Righe mostrate nell'anteprima dati
+PREVIEW_ROWS = 20
 
 
 def slugify(name: str) -> str:
@@ -36,7 +40,7 @@ class ProjectState(rx.State):
     file_name: str = ""
     source_columns: list[str] = []
     column_mapping: dict[str, str] = {}
-    preview_data: list[dict] = []
+    preview_rows: list[dict[str, str]] = []   # anteprima già convertita in stringhe
     is_project_creatable: bool = False
     # --- Derivati
     project_slug: str = ""
@@ -142,6 +146,7 @@ class ProjectState(rx.State):
             clean_dir(shp_dir)
             shp_path = extract_shapefile(zip_path, shp_dir)
             self.buildings_shp_path = str(shp_path.resolve())
+            self._load_preview(shp_path)
 
             print("DEBUG: writing project.json")
             proj_dir.mkdir(parents=True, exist_ok=True)
@@ -165,8 +170,24 @@ class ProjectState(rx.State):
             print(f"DEBUG: finalize_project error: {e}")
             rx.toast.error(f"Finalize error: {e}")
 
+    def _load_preview(self, shp_path: Path) -> None:
+        """Colonne e prime PREVIEW_ROWS righe (solo attributi) come stringhe pronte per la tabella."""
+        try:
+            df = pyogrio.read_dataframe(str(shp_path), read_geometry=False, max_features=PREVIEW_ROWS)
+        except Exception as e:
+            print(f"DEBUG: preview error: {e}")
+            self.source_columns, self.preview_rows = [], []
+            return
+        self.source_columns = [str(c) for c in df.columns]
+        self.preview_rows = [
+            {str(c): ("" if pd.isna(v) else str(v)) for c, v in row.items()}
+            for row in df.to_dict("records")
+        ]
+
     # Utility per resettare l’upload (se serve in UI)
     def reset_upload(self):
         self.upload_file = None
         self.upload_ok = False
-        self.buildings_shp_path = ""
\ No newline at end of file
+        self.buildings_shp_path = ""
+        self.source_columns = []
+        self.preview_rows = []
\ No newline at end of file